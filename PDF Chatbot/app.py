@@ -1,227 +1,678 @@
 # PART-1 :#
 # Import the libraries
-import PyPDF2
-import fitz  # PyMuPDF
+# pandas and reportlab are only needed for CSV and PDF export; they are imported where they are used,
+# so a new server process does not pay for them before the first page is shown
 import streamlit as st
-import ollama
-import pandas as pd
 import re
+import threading
 import time  # Added for response timing
-from io import BytesIO
-from reportlab.lib.pagesizes import letter
-from reportlab.pdfgen import canvas
-from reportlab.lib.utils import simpleSplit
+import bisect
+import html
+import math
+import os
+import uuid
+from array import array
+from collections import defaultdict
 from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from extraction import count_pages  # Page-sharded process-pool extraction engine
+from metrics import METRICS  # Process-wide latency/token histograms with Prometheus and JSONL export
+from docstore import DOCUMENT_STORE  # Process-wide memory-mapped store of extracted text
+# UI-free extraction, retrieval, prompting and streaming logic (shared with batch_qa.py)
+from core import (
+    LLM_MODEL, OLLAMA_KEEP_ALIVE, OLLAMA_OPTIONS, PERSONALITY_TONES, TOKEN_PATTERN, RetrievalIndex, StreamCollector,
+    answer_question, document_fingerprint, hash_pdf_bytes, iter_pdf_pages, summarize, table_csv, table_frames,
+    tokenize,
+)
+from client_pool import BoundedClient, get_client_pool  # Shared Ollama clients with a fair queue across sessions and endpoints
+from history import ConversationHistory  # Append-only chat history with per-entry HTML and spill to disk
+from history_export import EXPORT_FORMATS, HistoryExport  # Background JSONL/Markdown/PDF export of the history
 #-------------------------------------------
-# Function to extract text from a PDF file
-# Parallel PDF text extraction
-def extract_text_from_pdf_parallel(pdf_files):
-    def extract_single_pdf(pdf_file):
+INGEST_FILE_WORKERS = int(os.environ.get("PDF_CHATBOT_INGEST_WORKERS", 4))  # Files extracted at the same time (all sessions)
+INGEST_POLL_SECONDS = 0.5  # How often the progress panel refreshes while documents are loading
+# Queue priorities in the shared Ollama client pool (lower is served first)
+QUESTION_PRIORITY = 0
+SUMMARY_PRIORITY = 1
+# Ollama requests one batch summary may have queued or in flight at once; 0 uses the pool's capacity
+BATCH_SUMMARY_MAX_INFLIGHT = int(os.environ.get("PDF_CHATBOT_BATCH_SUMMARY_INFLIGHT", 0))
+BATCH_POLL_SECONDS = 0.5  # How often the batch summary panel refreshes while summaries stream
+TABLE_PREVIEW_ROWS = 20  # Rows of an extracted table kept in the conversation history
+HISTORY_PAGE_SIZE = int(os.environ.get("PDF_CHATBOT_HISTORY_PAGE_SIZE", 20))  # History entries shown per "Load older"
+EXPORT_POLL_SECONDS = 0.5  # How often the export status refreshes while a file is being written
+
+# Give a document a display name that does not collide with already loaded documents
+def unique_doc_name(name, existing_names):
+    if name not in existing_names:
+        return name
+    base, ext = os.path.splitext(name)
+    counter = 2
+    while f"{base} ({counter}){ext}" in existing_names:
+        counter += 1
+    return f"{base} ({counter}){ext}"
+
+# Thread pool shared by all sessions for background ingestion
+@st.cache_resource
+def get_ingest_executor():
+    return ThreadPoolExecutor(max_workers=INGEST_FILE_WORKERS, thread_name_prefix="pdf-ingest")
+
+# Background ingestion of one session's uploads
+# Worker threads only touch this object; the Streamlit script drains it into session state
+class IngestionJob:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started_docs = []  # (doc_name, StoredDocument) whose pages are being written to the document store
+        self.pending_pages = []  # (doc_name, page_num) not yet indexed by the session
+        self.finished_docs = []  # (doc_name, StoredDocument) whose last page has been extracted
+        self.errors = []  # (doc_name, message) for documents that failed
+        self.pages_total = 0
+        self.pages_done = 0
+        self.active_docs = 0
+        self.started_at = None
+        self.cancelled = False
+
+    @property
+    def active(self):
+        return self.active_docs > 0
+
+    # Queue documents for extraction; docs is a list of (doc_name, content_hash, pdf_bytes)
+    def submit(self, docs):
+        executor = get_ingest_executor()
+        for doc_name, content_hash, pdf_bytes in docs:
+            with self.lock:
+                if not self.active:
+                    # Restart the counters for a fresh batch
+                    self.pages_total = self.pages_done = 0
+                    self.started_at = time.time()
+                self.active_docs += 1
+            executor.submit(self._ingest_doc, doc_name, content_hash, pdf_bytes)
+
+    def _ingest_doc(self, doc_name, content_hash, pdf_bytes):
+        document = None
         try:
-            pdf_document = fitz.open(stream=pdf_file.read(), filetype="pdf")
-            text = ""
-            for page_num in range(pdf_document.page_count):
-                page = pdf_document[page_num]
-                text += page.get_text("text")
-            return pdf_file.name, text
+            # A document another session already loaded is read back from the shared store
+            shared = DOCUMENT_STORE.get(content_hash)
+            if shared is not None:
+                # Its tables are already on the shared document, and so are the indexes built from it
+                document, pages = shared, ((page_num, None, []) for page_num in range(1, shared.page_count + 1))
+                page_count = shared.page_count
+            else:
+                document, pages = DOCUMENT_STORE.create(), iter_pdf_pages(pdf_bytes, content_hash)
+                page_count = count_pages(pdf_bytes)
+            with self.lock:
+                self.pages_total += page_count
+                self.started_docs.append((doc_name, document))
+            with METRICS.span("extract_file"):
+                for page_num, page_text, page_tables in pages:
+                    if self.cancelled:
+                        if shared is None:
+                            DOCUMENT_STORE.discard(document)
+                        return
+                    if shared is None:
+                        document.append_page(page_text, page_tables)
+                    with self.lock:
+                        self.pending_pages.append((doc_name, page_num))
+                        self.pages_done += 1
+            if shared is None:
+                document = DOCUMENT_STORE.commit(content_hash, document)
+            with self.lock:
+                self.finished_docs.append((doc_name, document))
         except Exception as e:
-            st.error(f"Error extracting text from {pdf_file.name}: {e}")
-            return pdf_file.name, None
-    with ThreadPoolExecutor() as executor:
-        results = list(executor.map(extract_single_pdf, pdf_files))
-    # Convert results into a dictionary for session state
-    pdf_texts = {name: text for name, text in results if text is not None}
-    return pdf_texts
+            with self.lock:
+                self.errors.append((doc_name, str(e)))
+        finally:
+            with self.lock:
+                self.active_docs -= 1
+
+    # Take everything extracted since the last call
+    def drain(self):
+        with self.lock:
+            started, self.started_docs = self.started_docs, []
+            pages, self.pending_pages = self.pending_pages, []
+            finished, self.finished_docs = self.finished_docs, []
+            errors, self.errors = self.errors, []
+        return started, pages, finished, errors
+
+    # Pages done, pages known so far and throughput in pages per second
+    def progress(self):
+        with self.lock:
+            elapsed = time.time() - self.started_at if self.started_at else 0
+            rate = self.pages_done / elapsed if elapsed > 0 else 0.0
+            return self.pages_done, self.pages_total, rate
+
+# Point the session and its indexes at a document in the store
+def set_session_document(doc_name, document):
+    st.session_state.pdf_documents[doc_name] = document
+    st.session_state.retrieval_index.set_document(doc_name, document)
+    st.session_state.search_index.set_document(doc_name, document)
+
+# Move newly extracted pages from the background job into session state and the indexes
+# Page text itself lives only in the document store, and the per-document indexes are built once and shared
+# through it; the session keeps references and links the pages it has seen
+def merge_ingested_pages():
+    started, pages, finished, errors = st.session_state.ingestion_job.drain()
+    for doc_name, document in started:
+        set_session_document(doc_name, document)
+        st.session_state.loading_docs.add(doc_name)
+    page_counts = {}
+    for doc_name, page_num in pages:
+        page_counts[doc_name] = max(page_num, page_counts.get(doc_name, 0))
+    # Index page by page so questions can use documents that are still loading
+    for doc_name, page_count in page_counts.items():
+        with METRICS.span("index_pages", index="retrieval"):
+            st.session_state.retrieval_index.index_pages(doc_name, page_count)
+        with METRICS.span("index_pages", index="search"):
+            st.session_state.search_index.index_pages(doc_name, page_count)
+    for doc_name, document in finished:
+        # Switch to the shared copy in case another session committed the same content first
+        set_session_document(doc_name, document)
+        st.session_state.loading_docs.discard(doc_name)
+        st.session_state.uploaded_files.append(doc_name)
+        blank_pages = document.pages_without_text()
+        if blank_pages:
+            shown = ", ".join(map(str, blank_pages[:10])) + (" ..." if len(blank_pages) > 10 else "")
+            st.session_state.ingest_messages.append((
+                "warning",
+                f"{doc_name}: {len(blank_pages)} of {document.page_count} pages have no text layer (pages {shown}); "
+                "they may be scanned images, and their content cannot be searched, cited or summarized.",
+            ))
+    for doc_name, message in errors:
+        document = st.session_state.pdf_documents.pop(doc_name, None)
+        content_hash = st.session_state.pdf_hashes.pop(doc_name, None)
+        st.session_state.loading_docs.discard(doc_name)
+        st.session_state.retrieval_index.remove_document(doc_name)
+        st.session_state.search_index.remove_document(doc_name)
+        # The pages written so far are in a private copy that never reached the store; nothing reads it any more
+        if document is not None and DOCUMENT_STORE.get(content_hash) is not document:
+            DOCUMENT_STORE.discard(document)
+        # The uploader still holds the file; remember it so later reruns do not submit it again (uploading it anew retries)
+        st.session_state.failed_uploads.update(
+            file_id for file_id, upload_hash in st.session_state.upload_hashes.items() if upload_hash == content_hash
+        )
+        st.session_state.ingest_messages.append(("error", f"Error extracting text from {doc_name}: {message}"))
+    return finished
+
+# Progress panel for background ingestion (re-run on a timer as a fragment while documents load)
+def render_ingestion_progress():
+    job = st.session_state.ingestion_job
+    merge_ingested_pages()
+    # Kept in session state, so they are still shown after the next poll or the final rerun
+    for level, message in st.session_state.ingest_messages:
+        getattr(st, level)(message)
+    if job.active:
+        pages_done, pages_total, rate = job.progress()
+        st.progress(
+            pages_done / pages_total if pages_total else 0.0,
+            text=f"Extracting pages: {pages_done}/{pages_total} ({rate:.1f} pages/s) - you can already search and ask questions",
+        )
+    elif st.session_state.get("ingest_announce"):
+        st.session_state.ingest_announce = False
+        # Refresh the whole page so every section sees the completed documents
+        st.session_state.ingest_success = not any(level == "error" for level, _ in st.session_state.ingest_messages)
+        st.rerun()
+
+# PART-1B :#
+#-------------------------------------------
+# Positional inverted index behind the "Search in Documents" panel
+SEARCH_MAX_HITS = 20  # Ranked hits shown for a query
+SNIPPET_CHARS = 90  # Characters of context on each side of a hit
+QUERY_PATTERN = re.compile(r'"([^"]+)"|(\S+)')
+
+# Generator over (lowercase_token, start, end) for every word in the original text
+def iter_tokens(text):
+    for match in TOKEN_PATTERN.finditer(text):
+        yield match.group(0).lower(), match.start(), match.end()
+
+# Parse a query into clauses: ("term", t), ("prefix", p) for a trailing * and ("phrase", [t1, t2, ...]) for "quotes"
+def parse_search_query(query):
+    clauses = []
+    for phrase, word in QUERY_PATTERN.findall(query):
+        if phrase:
+            terms = tokenize(phrase)
+            if len(terms) > 1:
+                clauses.append(("phrase", terms))
+            elif terms:
+                clauses.append(("term", terms[0]))
+        elif word.endswith("*") and tokenize(word):
+            clauses.append(("prefix", tokenize(word)[0]))
+        else:
+            clauses.extend(("term", term) for term in tokenize(word))
+    return clauses
+
+# Positional index of one stored document: term -> {page_num: token positions}
+# It depends only on the document's content, so it is kept on the document (see StoredDocument.indexes), built once
+# by the first session that needs each page and shared by every session holding the document
+class DocumentSearchIndex:
+    def __init__(self):
+        self.postings = defaultdict(dict)  # Term -> {page_num: array of token positions}
+        self.page_count = 0  # Pages indexed so far
+        self._vocabulary = []  # Sorted terms for prefix queries, rebuilt when terms were added
+        self._lock = threading.Lock()
+
+    # Index the document's pages up to page_count unless that was already done
+    def ensure_pages(self, document, page_count):
+        if self.page_count >= page_count:
+            return
+        with self._lock:
+            for page_num in range(self.page_count + 1, page_count + 1):
+                page_postings = defaultdict(list)
+                for position, (token, _, _) in enumerate(iter_tokens(document.page_text(page_num))):
+                    page_postings[token].append(position)
+                for token, positions in page_postings.items():
+                    self.postings[token][page_num] = array("I", positions)
+                self.page_count = page_num
+
+    # Terms starting with prefix, found by binary search in the sorted vocabulary
+    def expand_prefix(self, prefix):
+        if len(self._vocabulary) != len(self.postings):
+            self._vocabulary = sorted(self.postings)
+        vocabulary = self._vocabulary
+        start = bisect.bisect_left(vocabulary, prefix)
+        terms = []
+        for term in vocabulary[start:]:
+            if not term.startswith(prefix):
+                break
+            terms.append(term)
+        return terms
+
+    # {page_num: positions} of a term on pages 1..last_page (copied at once, so pages indexed meanwhile are ignored)
+    def term_pages(self, term, last_page):
+        return {page_num: positions for page_num, positions in list(self.postings.get(term, {}).items()) if page_num <= last_page}
+
+    # Page number -> sorted match positions for one clause, on pages 1..last_page
+    def match_clause(self, kind, value, last_page):
+        if kind == "term":
+            return self.term_pages(value, last_page)
+        if kind == "prefix":
+            matches = defaultdict(list)
+            for term in self.expand_prefix(value):
+                for page_num, positions in self.term_pages(term, last_page).items():
+                    matches[page_num].extend(positions)
+            return {page_num: sorted(positions) for page_num, positions in matches.items()}
+        # Phrase: every following term must appear at the next position
+        first, rest = value[0], value[1:]
+        following_pages = [self.term_pages(term, last_page) for term in rest]
+        matches = {}
+        for page_num, positions in self.term_pages(first, last_page).items():
+            following = [set(pages.get(page_num, ())) for pages in following_pages]
+            if not all(following):
+                continue
+            hits = [p for p in positions if all(p + i + 1 in following[i] for i in range(len(rest)))]
+            if hits:
+                matches[page_num] = hits
+        return matches
+
+# Positional index of a stored document, created on first use and shared by everyone holding the document
+def document_search_index(document):
+    index = document.indexes.get("search")
+    if index is None:
+        index = document.indexes.setdefault("search", DocumentSearchIndex())
+    return index
+
+# One session's search corpus: its documents and how many pages of each are searchable
+class SearchIndex:
+    def __init__(self):
+        self.documents = {}  # Document name -> StoredDocument (its text and shared positional index)
+        self.linked_pages = {}  # Document name -> pages of it that are searchable (the first n)
+
+    def __len__(self):
+        return sum(self.linked_pages.values())
+
+    # Document that holds the text of doc_name's pages (a shared copy can replace a private one)
+    def set_document(self, doc_name, document):
+        self.documents[doc_name] = document
+        if self.linked_pages.get(doc_name):
+            document_search_index(document).ensure_pages(document, self.linked_pages[doc_name])
+
+    # Make doc_name's pages up to page_count searchable, indexing any that no session has indexed yet
+    def index_pages(self, doc_name, page_count):
+        document = self.documents[doc_name]
+        document_search_index(document).ensure_pages(document, page_count)
+        self.linked_pages[doc_name] = max(page_count, self.linked_pages.get(doc_name, 0))
+
+    # Drop every page of a document from the index
+    def remove_document(self, doc_name):
+        self.documents.pop(doc_name, None)
+        self.linked_pages.pop(doc_name, None)
+
+    # (doc_name, page_num) key -> sorted match positions for one clause
+    def _match_clause(self, kind, value):
+        matches = {}
+        for doc_name, last_page in self.linked_pages.items():
+            index = document_search_index(self.documents[doc_name])
+            for page_num, positions in index.match_clause(kind, value, last_page).items():
+                matches[(doc_name, page_num)] = positions
+        return matches
+
+    # Ranked page hits for a query: pages must match every clause; score is tf-idf over pages
+    def search(self, query, max_hits=SEARCH_MAX_HITS):
+        clauses = parse_search_query(query)
+        if not clauses or not self.linked_pages:
+            return []
+        scores = None
+        first_positions = {}
+        for kind, value in clauses:
+            matches = self._match_clause(kind, value)
+            idf = math.log(1 + len(self) / (1 + len(matches)))
+            clause_scores = {key: len(positions) * idf for key, positions in matches.items()}
+            if scores is None:
+                scores = clause_scores
+                first_positions = {key: positions[0] for key, positions in matches.items()}
+            else:
+                scores = {key: score + clause_scores[key] for key, score in scores.items() if key in clause_scores}
+            if not scores:
+                return []
+        highlight_terms = {value for kind, value in clauses if kind == "term"}
+        highlight_terms.update(term for kind, value in clauses if kind == "phrase" for term in value)
+        highlight_prefixes = tuple(value for kind, value in clauses if kind == "prefix")
+        hits = []
+        for key in sorted(scores, key=scores.get, reverse=True)[:max_hits]:
+            page = self.documents[key[0]].page(key[1])
+            snippet = self._snippet(page, first_positions[key], highlight_terms, highlight_prefixes)
+            hits.append({"doc": key[0], "page": page, "score": scores[key], "snippet": snippet})
+        return hits
+
+    # HTML snippet around a token position of a page with the query terms highlighted
+    def _snippet(self, page, position, highlight_terms, highlight_prefixes):
+        text = page.text
+        center = 0
+        for index, (_, token_start, _) in enumerate(iter_tokens(text)):
+            if index == position:
+                center = token_start
+                break
+        start = max(center - SNIPPET_CHARS, 0)
+        end = min(center + SNIPPET_CHARS, len(text))
+        window = text[start:end]
+        parts = []
+        last = 0
+        for token, token_start, token_end in iter_tokens(window):
+            if token in highlight_terms or (highlight_prefixes and token.startswith(highlight_prefixes)):
+                parts.append(html.escape(window[last:token_start]))
+                parts.append(f"<mark>{html.escape(window[token_start:token_end])}</mark>")
+                last = token_end
+        parts.append(html.escape(window[last:]))
+        snippet = " ".join("".join(parts).split())
+        return ("…" if start > 0 else "") + snippet + ("…" if end < len(text) else "")
+
+# PART-2A :#
+#-------------------------------------------
+# Shared streaming renderer for model answers and summaries
+STREAM_FLUSH_SECONDS = 0.15  # Minimum time between bubble updates while streaming
+STREAM_FLUSH_CHARS = 600  # Flush earlier if this much new text has arrived
+# Bubble colors per palette: (dark mode background, light mode background)
+BUBBLE_PALETTES = {
+    "summary": ("#28c9b7", "#95f5ea"),
+    "answer": ("#2454a6", "#b0d9f5"),
+    "search": ("#9874f2", "#d3c2fc"),
+}
+# Bubble template with dynamic theming
+BUBBLE_TEMPLATE = """
+<div style="
+    background-color: {bg_color}; 
+    color: {text_color}; 
+    padding: 10px 15px; 
+    border-radius: 10px; 
+    box-shadow: 0px 2px 6px rgba(0, 0, 0, 0.1); 
+    margin: 10px 0;
+    font-size: 16px;
+    line-height: 1.6;
+    font-family: Arial, sans-serif;
+    overflow-wrap: break-word;  /* Allow long text to wrap */
+    word-break: break-word;    /* Break long words */
+    white-space: pre-wrap;     /* Preserve whitespace and enable wrapping */
+    overflow: auto;            /* Add scrollbars if content overflows */
+    max-width: 100%;           /* Ensure the bubble doesn’t exceed the screen width */
+    transition: background-color 0.3s ease, color 0.3s ease;">
+{content}
+</div>
+"""
+
+# Opening and closing HTML of a themed bubble, computed once per palette and theme
+@st.cache_resource
+def get_bubble_frame(palette, theme_mode):
+    dark_bg, light_bg = BUBBLE_PALETTES[palette]
+    if theme_mode == "dark":
+        bg_color, text_color = dark_bg, "#ffffff"  # White text for dark mode
+    else:
+        bg_color, text_color = light_bg, "#000000"  # Black text for light mode
+    head, tail = BUBBLE_TEMPLATE.format(bg_color=bg_color, text_color=text_color, content="\0").split("\0")
+    return head, tail
+
+# Light or dark theme, read once per script run (this module is re-executed on every full rerun)
+@lru_cache(maxsize=1)
+def get_theme_mode():
+    return st.get_option("theme.base")
+
+# Render text inside a themed bubble
+def render_bubble(palette, content):
+    head, tail = get_bubble_frame(palette, get_theme_mode())
+    return head + content + tail
+
+# Streams model output into a bubble, batching tokens so the browser gets a bounded number of updates
+class StreamRenderer(StreamCollector):
+    def __init__(self, palette, start_time=None):
+        super().__init__(palette, start_time)
+        # Create placeholders for map-reduce progress, response and timer
+        self.status_placeholder = st.empty()
+        self.response_placeholder = st.empty()
+        self.timer_placeholder = st.empty()
+        self.head, self.tail = get_bubble_frame(palette, get_theme_mode())
+        self.pending_chars = 0
+        self.last_flush = 0.0
+
+    def feed(self, content):
+        if not content:
+            return
+        super().feed(content)
+        now = time.time()
+        self.pending_chars += len(content)
+        if now - self.last_flush >= STREAM_FLUSH_SECONDS or self.pending_chars >= STREAM_FLUSH_CHARS:
+            self.flush(now)
+
+    def notice(self, message):
+        super().notice(message)
+        st.warning(message)
+
+    def progress(self, fraction, text=None):
+        if fraction is None:
+            self.status_placeholder.empty()
+        else:
+            self.status_placeholder.progress(fraction, text=text)
+
+    # Push the text so far and the timing line to the browser
+    def flush(self, now=None):
+        now = now or time.time()
+        text = self.text
+        self.parts = [text]
+        self.pending_chars = 0
+        self.last_flush = now
+        with METRICS.span("render_flush", kind=self.kind):
+            self.response_placeholder.markdown(self.head + text + self.tail, unsafe_allow_html=True)
+        stats = f"**Response Time:** {now - self.start_time:.2f} seconds"
+        if self.ttft is not None:
+            stats += f" | **Time to first token:** {self.ttft:.2f} s | **Speed:** {self.tokens_per_second:.1f} tokens/s"
+        self.timer_placeholder.markdown(stats, unsafe_allow_html=True)
+        return text
+
+    def finish(self):
+        self.flush()
+        return super().finish()
+
+# Load the model into memory once per server process, in the background, so the first question is not a cold start
+@st.cache_resource
+def warm_up_model():
+    status = {"state": "loading", "seconds": None}
+    def load():
+        start_time = time.time()
+        # An empty prompt loads the model on every endpoint (with the same options, so the context is not reallocated later)
+        results = get_client_pool().broadcast(
+            "generate", model=LLM_MODEL, prompt="", options=OLLAMA_OPTIONS, keep_alive=OLLAMA_KEEP_ALIVE
+        )
+        errors = [result for result in results if isinstance(result, Exception)]
+        status["state"] = f"failed ({errors[0]})" if len(errors) == len(results) else "ready"
+        status["seconds"] = time.time() - start_time
+    threading.Thread(target=load, name="ollama-warm-up", daemon=True).start()
+    return status
+
+# Pool client for this browser session (scripts without a session share one fair-share slot)
+def get_session_client(priority):
+    return get_client_pool().session(st.session_state.get("session_id", "local"), priority)
 
 # PART-2 :#
 #-------------------------------------------
-# Function to summarize document text    
+# Function to summarize document text (map-reduce for documents longer than one section)
 def summarize_text(doc_text, summary_type, bullet_points):
     try:
         # Start timing
         start_time = time.time()
-        # Determine the prompt based on summary type and bullet points
-        if summary_type == "Short":
-            prompt = "Provide a concise summary of the text in no more than 2 sentences."
-        elif summary_type == "Detailed":  # Detailed summary
-            if bullet_points:
-                prompt = (
-                    "Provide a detailed summary of the text in 6-8 lines. "
-                    "Use bullet points for each key point."
-                )
-            else:
-                prompt = "Provide a detailed summary of the text in 6-8 lines."
-        elif summary_type == "Tabular":
-            prompt = (
-                "Summarize the full pdf data in a table format with max 6-7 points."
-            )
-        # Using Ollama API to call the LLaMA model with streaming response
-        response = ollama.chat(
-            model="llama3.2:1b",
-            messages=[
-                {
-                    "role": "system",
-                    "content": (
-                        "You are a summarization expert. " + prompt
-                    ),
-                },
-                {
-                    "role": "user",
-                    "content": doc_text # Truncate to avoid exceeding token limits
-                },
-            ],
-            stream=True,  # Enable streaming
-        )
-        # Caching repeated tasks to avoid unnecessary recomputation
-        @st.cache_data
-        def get_cached_answer(question, text):
-            return ask_llama_question(text, question)
-        # Create placeholders for response and timer
-        response_placeholder = st.empty()
-        timer_placeholder = st.empty()
-        response_text = ""
-        # Bubble template with dynamic theming
-        bubble_template = """
-        <div style="
-            background-color: {bg_color}; 
-            color: {text_color}; 
-            padding: 10px 15px; 
-            border-radius: 10px; 
-            box-shadow: 0px 2px 6px rgba(0, 0, 0, 0.1); 
-            margin: 10px 0;
-            font-size: 16px;
-            line-height: 1.6;
-            font-family: Arial, sans-serif;
-            overflow-wrap: break-word;  /* Allow long text to wrap */
-            word-break: break-word;    /* Break long words */
-            white-space: pre-wrap;     /* Preserve whitespace and enable wrapping */
-            overflow: auto;            /* Add scrollbars if content overflows */
-            max-width: 100%;           /* Ensure the bubble doesn’t exceed the screen width */            
-            transition: background-color 0.3s ease, color 0.3s ease;">
-        {content}
-        </div>
-        """
-        # Detect user's theme preference for adaptive styling
-        theme_mode = st.get_option("theme.base")  # Fetch current theme dynamically
-        if theme_mode == "dark":
-            bg_color = "#28c9b7"  # Dark blue for dark mode
-            text_color = "#ffffff"  # White text for dark mode
-        else:
-            bg_color = "#95f5ea"  # Pastel blue for light mode
-            text_color = "#000000"  # Black text for light mode
-        # Stream the response and update dynamically
-        for chunk in response:
-            if "message" in chunk:
-                content = chunk["message"].get("content", "")
-                response_text += content             
-                # Update timer dynamically
-                elapsed_time = time.time() - start_time
-                timer_placeholder.markdown(f"**Response Time:** {elapsed_time:.2f} seconds", unsafe_allow_html=True)
-                # Format the response with adaptive colors
-                styled_response = bubble_template.format(
-                    bg_color=bg_color, text_color=text_color, content=response_text
-                )
-                response_placeholder.markdown(styled_response, unsafe_allow_html=True)
-        # Final response time update
-        elapsed_time = time.time() - start_time
-        timer_placeholder.markdown(f"**Response Time:** {elapsed_time:.2f} seconds", unsafe_allow_html=True)
+        # Stream the response into a themed bubble with batched updates
+        renderer = StreamRenderer("summary", start_time)
+        # Summary sections queue behind interactive questions from every session
+        client = get_session_client(SUMMARY_PRIORITY)
         # Return the response text along with elapsed time
-        return response_text, elapsed_time
+        return summarize(doc_text, summary_type, bullet_points, sink=renderer, client=client)
     except Exception as e:
         st.error(f"Error querying LLaMA: {e}")
         return None, None
 
+# Collects one document's summary in a batch; the script reads text, progress and notices while it streams
+class BatchSummaryCollector(StreamCollector):
+    def __init__(self):
+        super().__init__("summary")
+        self.fraction = None  # Map-reduce progress, None outside the map step
+        self.status = None
+
+    def progress(self, fraction, text=None):
+        self.fraction, self.status = fraction, text
+
+# Background summaries of several documents for one session
+# Documents are summarized by a small thread pool through one BoundedClient, so the batch never has more than
+# max_inflight Ollama requests queued or in flight; the shared pool spreads them over the endpoints.
+# Worker threads only touch this object; the Streamlit script polls it to draw the streams and record results.
+class BatchSummaryJob:
+    def __init__(self, docs, summary_type, bullet_points, session_id, max_inflight=BATCH_SUMMARY_MAX_INFLIGHT):
+        pool = get_client_pool()
+        self.max_inflight = max_inflight or pool.capacity
+        self.client = BoundedClient(pool.session(session_id, SUMMARY_PRIORITY), self.max_inflight)
+        self.lock = threading.Lock()
+        # Document name -> state; sink streams the text, summary/elapsed/error are set when it is over
+        self.items = {
+            doc_name: {"sink": BatchSummaryCollector(), "state": "queued", "summary": None, "tables": False, "elapsed": None,
+                       "error": None}
+            for doc_name, _ in docs
+        }
+        self.finished = []  # Documents whose summary is over and not yet recorded in the history, in completion order
+        self.done = 0
+        self.started_at = time.time()
+        self.cancelled = False
+        executor = ThreadPoolExecutor(max_workers=min(self.max_inflight, len(docs)) or 1, thread_name_prefix="batch-summary")
+        for doc_name, document in docs:
+            executor.submit(self._summarize, doc_name, document, summary_type, bullet_points)
+        executor.shutdown(wait=False)  # Threads exit once the queue is empty
+
+    @property
+    def active(self):
+        return self.done < len(self.items)
+
+    def _summarize(self, doc_name, document, summary_type, bullet_points):
+        item = self.items[doc_name]
+        try:
+            if self.cancelled:
+                item["state"] = "cancelled"
+                return
+            item["state"] = "running"
+            item["sink"].start_time = time.time()  # Response time counts from the start, not from the queue
+            if summary_type == "Tabular" and document.tables:
+                # The extracted tables are the tabular summary; no model round-trip
+                item["summary"], item["elapsed"] = document_tables_html(document)
+                item["tables"] = True
+            else:
+                item["summary"], item["elapsed"] = summarize(
+                    document.text(), summary_type, bullet_points, sink=item["sink"], client=self.client
+                )
+            item["state"] = "done"
+        except Exception as e:
+            item["state"], item["error"] = "failed", str(e)
+        finally:
+            with self.lock:
+                self.finished.append(doc_name)
+                self.done += 1
+
+    # Take the documents finished since the last call
+    def drain(self):
+        with self.lock:
+            finished, self.finished = self.finished, []
+        return finished
+
+# Batch summary panel: records finished summaries in the history and shows every document's stream
+# (re-run on a timer as a fragment while summaries are being generated)
+def render_batch_summary(polling=False):
+    job = st.session_state.batch_summary_job
+    for doc_name in job.drain():
+        item = job.items[doc_name]
+        if item["summary"]:
+            prefix = "Tables in" if item["tables"] else "Summary for"
+            st.session_state.chat_history.append({
+                "role": "summary",
+                "content": f"{prefix} {doc_name}: {item['summary']}",
+                "response_time": item["elapsed"]
+            })
+    running = sum(item["state"] == "running" for item in job.items.values())
+    st.progress(
+        job.done / len(job.items),
+        text=f"Summarized {job.done}/{len(job.items)} documents in {time.time() - job.started_at:.1f} s "
+             f"({running} in progress, at most {job.max_inflight} Ollama requests at once)",
+    )
+    for doc_name, item in job.items.items():
+        sink = item["sink"]
+        status = item["state"]
+        if item["state"] == "running" and sink.fraction is not None:
+            status = sink.status
+        elif item["state"] == "done":
+            status = f"done in {item['elapsed']:.2f} seconds"
+        elif item["state"] == "failed":
+            status = f"failed: {item['error']}"
+        st.markdown(f"**{html.escape(doc_name)}** - {status}")
+        text = item["summary"] or sink.text
+        if text:
+            st.markdown(render_bubble("summary", text), unsafe_allow_html=True)
+    if polling and not job.active:
+        # Everything is in the history: redraw the page once without the timer
+        st.rerun()
+
 # PART-3:#
 #-------------------------------------------
 # Function to interact with LLaMA 3.2 model via Ollama
-def ask_llama_question(text, question):
+# Returns the answer, elapsed time and, for cache hits, the response time that was saved
+def ask_llama_question(retrieval_index, question, doc_fingerprint=None):
     try:
         # Determine bot personality
         personality = st.session_state.get('selected_personality', 'Neutral')
-        personality_tone = {
-            "Neutral": "You are an excellent pdf-document chatbot.",
-            "Formal": "You are a highly professional and formal pdf-document chatbot.",
-            "Casual": "You are a friendly and casual pdf-document chatbot.",
-            "Technical": "You are a highly technical and detail-oriented pdf-document chatbot."
-        }.get(personality, "You are an excellent pdf-document chatbot.")
+        personality_tone = PERSONALITY_TONES.get(personality, PERSONALITY_TONES["Neutral"])
         # Start timing
         start_time = time.time()
-        # Using Ollama API to call the LLaMA model with streaming response
-        response = ollama.chat(
-            model="llama3.2:1b",
-            messages=[
-                {
-                    "role": "system",
-                    "content": (
-                        f"{personality_tone} "
-                        "Give accurate and concise answers only to the question that is asked. "
-                        "You are able to handle data from PDFs such as key-value pairs, tabular data, graphs, numbers, calculations, etc."
-                    ),
-                },
-                {
-                    "role": "user",
-                    "content": (
-                        f"Here is the combined text from all uploaded documents: {text}... "
-                        f"Please answer the question: {question}"
-                    ),
-                },
-            ],
-            stream=True,  # Enable streaming
+        # Stream the response into a themed bubble with batched updates
+        renderer = StreamRenderer("answer", start_time)
+        client = get_session_client(QUESTION_PRIORITY)
+        response_text, elapsed_time, saved_time = answer_question(
+            retrieval_index, question, personality_tone, doc_fingerprint, sink=renderer, client=client
         )
-        # Create placeholders for response and timer
-        response_placeholder = st.empty()
-        timer_placeholder = st.empty()
-        response_text = ""
-        # Bubble template with dynamic theming
-        bubble_template = """
-        <div style="
-            background-color: {bg_color}; 
-            color: {text_color}; 
-            padding: 10px 15px; 
-            border-radius: 10px; 
-            box-shadow: 0px 2px 6px rgba(0, 0, 0, 0.1); 
-            margin: 10px 0;
-            font-size: 16px;
-            line-height: 1.6;
-            font-family: Arial, sans-serif;
-            overflow-wrap: break-word;  /* Allow long text to wrap */
-            word-break: break-word;    /* Break long words */
-            white-space: pre-wrap;     /* Preserve whitespace and enable wrapping */
-            overflow: auto;            /* Add scrollbars if content overflows */
-            max-width: 100%;           /* Ensure the bubble doesn’t exceed the screen width */            
-            transition: background-color 0.3s ease, color 0.3s ease;">
-        {content}
-        </div>
-        """
-        # Detect user's theme preference for adaptive styling
-        theme_mode = st.get_option("theme.base")  # Fetch current theme dynamically
-        if theme_mode == "dark":
-            bg_color = "#2454a6"  # Dark blue for dark mode
-            text_color = "#ffffff"  # White text for dark mode
+        notes = []
+        if saved_time is not None:
+            notes.append(f"⚡ Answered from cache (saved {saved_time:.2f} seconds)")
         else:
-            bg_color = "#b0d9f5"  # Pastel blue for light mode
-            text_color = "#000000"  # Black text for light mode
-        # Stream the response and update dynamically
-        for chunk in response:
-            if "message" in chunk:
-                content = chunk["message"].get("content", "")
-                response_text += content             
-                # Update timer dynamically
-                elapsed_time = time.time() - start_time
-                timer_placeholder.markdown(f"**Response Time:** {elapsed_time:.2f} seconds", unsafe_allow_html=True)
-                # Format the response with adaptive colors
-                styled_response = bubble_template.format(
-                    bg_color=bg_color, text_color=text_color, content=response_text
-                )
-                response_placeholder.markdown(styled_response, unsafe_allow_html=True)
-        # Final response time update
-        elapsed_time = time.time() - start_time
-        timer_placeholder.markdown(f"**Response Time:** {elapsed_time:.2f} seconds", unsafe_allow_html=True)
+            # Keep time-to-first-token per question so warm-up and prefix reuse are visible
+            st.session_state.setdefault("ttft_log", []).append(renderer.ttft)
+            if renderer.context_saved_tokens:
+                notes.append(f"♻️ Passages repeated across documents were sent once (about {renderer.context_saved_tokens} prompt tokens saved)")
+        for note in notes:
+            st.caption(note)
+        # Kept for the answer panel, which is drawn again after the page reruns
+        st.session_state.answer_notes = notes
         # Return the response text along with elapsed time
-        return response_text, elapsed_time
+        return response_text, elapsed_time, saved_time
     except Exception as e:
         st.error(f"Error querying LLaMA: {e}")
-        return None, None
+        return None, None, None
 
 # PART-4:#
 #-------------------------------------------
@@ -241,6 +692,7 @@ def detect_and_save_csv(answer):
                         columns = [col.strip() for col in line.split("|")[1:-1]]
                         rows.append(columns)
                 # Save CSV as a binary stream for download
+                import pandas as pd
                 csv_data = pd.DataFrame(rows[1:], columns=rows[0]).to_csv(index=False)
                 return csv_data
             else:
@@ -249,211 +701,231 @@ def detect_and_save_csv(answer):
             st.error(f"Error creating CSV: {e}")
     return None
 
+# File name for the CSV download of an extracted table
+def table_file_name(doc_name, table, position):
+    return f"{os.path.splitext(doc_name)[0]}_page{table['page']}_table{position}.csv"
+
+# Show a document's extracted tables with CSV downloads
+def show_document_tables(doc_name, document):
+    for position, (table, frame) in enumerate(zip(document.tables, table_frames(document)), start=1):
+        st.caption(f"Table {position} - page {table['page']}")
+        st.dataframe(frame, hide_index=True)
+        st.download_button(
+            label=f"Download table {position} as CSV",
+            data=table_csv(table),  # The exact cells, not the parsed numbers
+            file_name=table_file_name(doc_name, table, position),
+            mime="text/csv",
+            key=f"table-{doc_name}-{position}",
+        )
+
+# Tabular summary of a document built from its extracted tables, without a model round-trip
+# Returns the HTML kept in the conversation history and the elapsed time
+def document_tables_html(document):
+    start_time = time.time()
+    parts = []
+    for position, (table, frame) in enumerate(zip(document.tables, table_frames(document)), start=1):
+        # One line of HTML, so the history bubble's markdown does not break it up
+        table_html = frame.to_html(index=False, max_rows=TABLE_PREVIEW_ROWS, border=0).replace("\n", "")
+        parts.append(f"<b>Table {position} (page {table['page']})</b>{table_html}")
+    elapsed_time = time.time() - start_time
+    METRICS.observe("table_summary_seconds", elapsed_time)
+    return "".join(parts), elapsed_time
+
+# PART-4A:#
+#-------------------------------------------
+# Export conversation history: one background export per format, reused until the history changes
+def start_history_export(export_format):
+    exports = st.session_state.setdefault("history_exports", {})
+    if export_format not in exports:
+        exports[export_format] = HistoryExport(export_format)
+    exports[export_format].start(st.session_state.chat_history)
+
+# Progress or download button of an export (re-run on a timer as a fragment while the file is being written)
+def render_export_status(export_format, polling=False):
+    export = st.session_state.get("history_exports", {}).get(export_format)
+    if export is None:
+        return
+    label, mime, _ = EXPORT_FORMATS[export_format]
+    if export.running:
+        st.progress(
+            export.written / export.total if export.total else 0.0,
+            text=f"Exporting {label}: {export.written}/{export.total} entries - you can keep chatting",
+        )
+    elif polling:
+        # Finished: redraw the history section once without the timer
+        st.rerun()
+    elif export.error:
+        st.error(f"Error exporting chat history: {export.error}")
+    elif export.ready(st.session_state.chat_history):
+        st.download_button(
+            label=f"Download Chat History as {label}",
+            data=export.read_bytes,  # Read from the temporary file only when clicked
+            file_name=export.file_name(),
+            mime=mime,
+            on_click="ignore",
+        )
+
+# PART-4B:#
+#-------------------------------------------
+# Bot personality icons
+PERSONALITY_ICONS = {
+    "Neutral": "💬",  # Default robot icon
+    "Formal": "📝",   # Scroll icon for formal tone
+    "Casual": "🧑‍💼",   # Smile face for casual tone
+    "Technical": "⚙️",  # Gear icon for technical tone
+}
+
+# Function to get bot personality icon
+def get_personality_icon(personality):
+    return PERSONALITY_ICONS.get(personality, "💬")  # Default to "Neutral" if undefined
+
+# HTML bubble for one conversation history entry
+def render_history_entry(chat):
+    if chat["role"] == "user":
+        # User bubble with icon
+        return f"""
+            <div style="
+                display: flex;
+                align-items: flex-start;
+                margin: 10px 0;
+                justify-content: flex-start;">
+                <div style="
+                    margin-right: 10px;
+                    width: 35px;
+                    height: 35px;
+                    background-color: #8383eb;
+                    display: flex;
+                    align-items: center;
+                    justify-content: center;
+                    border-radius: 50%;">
+                    <div class="icon">👤</div>
+                </div>
+                <div style="
+                    background-color: #f7f7d2;
+                    color: #444;
+                    padding: 10px 15px;
+                    border-radius: 10px;
+                    max-width: 80%;
+                    font-size: 14px;
+                    box-shadow: 0 1px 3px rgba(0, 0, 0, 0.1);">
+                    {chat['content']}
+                </div>
+            </div>
+            """
+    if chat["role"] == "bot":
+        # Get the personality icon based on the saved personality
+        personality_icon = get_personality_icon(chat.get("personality", "Neutral"))  # Use saved personality here
+        response_time = chat.get("response_time", "")
+        cache_note = ""
+        if chat.get("cache_hit"):
+            cache_note = f" · cache hit, saved {chat['saved_time']:.2f} seconds"
+        # Bot bubble with icon
+        return f"""
+            <div style="
+                display: flex;
+                align-items: flex-start;
+                margin: 10px 0;
+                justify-content: flex-start;">
+                <div style="
+                    margin-right: 10px;
+                    width: 35px;
+                    height: 35px;
+                    background-color: #20c997;
+                    display: flex;
+                    align-items: center;
+                    justify-content: center;
+                    border-radius: 50%;">
+                    <div class="icon">🤖</div>
+                </div>
+                <div style="
+                    background-color: #f7f9fc;
+                    color: #444;
+                    padding: 10px 15px;
+                    border-radius: 10px;
+                    max-width: 80%;
+                    font-size: 14px;
+                    box-shadow: 0 1px 3px rgba(0, 0, 0, 0.1);">
+                    {chat['content']}<br><span style="font-size: 12px; color: #888;">(Response Time: {response_time:.2f} seconds{cache_note})</span>
+                </div>
+                <div class="icon">{personality_icon}</div>
+            </div>
+            """
+    if chat["role"] == "summary":
+        return f"""
+            <div style="
+                display: flex;
+                align-items: flex-start;
+                margin: 10px 0;
+                justify-content: flex-start;">
+                <div style="
+                    margin-right: 10px;
+                    width: 35px;
+                    height: 35px;
+                    background-color: #f4b400;
+                    display: flex;
+                    align-items: center;
+                    justify-content: center;
+                    border-radius: 50%;">
+                    <div class="icon">📄</div>
+                </div>
+                <div style="
+                    background-color: #f7f9fc;
+                    color: #444;
+                    padding: 10px 15px;
+                    border-radius: 10px;
+                    max-width: 80%;
+                    font-size: 14px;
+                    box-shadow: 0 1px 3px rgba(0, 0, 0, 0.1);">
+                    {chat['content']}<br><span style="font-size: 12px; color: #888;">(Response Time: {chat['response_time']:.2f} seconds)</span>
+                </div>
+            </div>
+            """
+    return ""
+
+# Empty conversation history that renders each entry's bubble once, when it is added
+def new_chat_history():
+    return ConversationHistory(render=render_history_entry)
+
 # PART-5:#
 #-------------------------------------------
-# Streamlit interface
-def main():
-    st.title("Chat with PDF Documents 🗂️")
-    # Clear button moved to the top
-    def clear_all():
-        st.session_state.uploaded_files = []
-        st.session_state.chat_history = []
-        st.session_state.pdf_texts = {}
-        st.session_state.clear_flag = True  # Mark that the chat was cleared
-    st.button("Clear All", on_click=clear_all)
-    # Initialize session state for uploaded files, chat history, and PDF texts if not present
-    if 'uploaded_files' not in st.session_state:
-        st.session_state.uploaded_files = []
-    if 'chat_history' not in st.session_state:
-        st.session_state.chat_history = []
-    if 'pdf_texts' not in st.session_state:
-        st.session_state.pdf_texts = {}
-    if 'clear_flag' not in st.session_state:
-        st.session_state.clear_flag = False  # Flag to track if chat was cleared
-    if 'selected_personality' not in st.session_state:
-        st.session_state.selected_personality = "Neutral"  # Default personality
-    # Allow multiple PDF uploads
-    st.subheader("Upload PDFs 🖨️")
-    uploaded_files = st.file_uploader("Click on Browse Files to choose the PDFs to be uploaded :",type="pdf", accept_multiple_files=True)
-    if uploaded_files:
-        total_files = len(uploaded_files)  # Total number of files
-        progress_bar = st.progress(0)  # Initialize the progress bar
-        # Process PDFs in parallel
-        uploaded_file_names = [file.name for file in uploaded_files]
-        new_files = [file for file in uploaded_files if file.name not in st.session_state.pdf_texts]
-        if new_files:
-            pdf_texts = extract_text_from_pdf_parallel(new_files) 
-            # Update session state
-            st.session_state.pdf_texts.update(pdf_texts)
-            st.session_state.uploaded_files.extend(uploaded_file_names)   
-            progress_bar.progress(1.0)  # Set progress to 100%
-            st.success("All PDFs have been processed. ✅")
-    # Combine all extracted text from PDFs
-    combined_text = " ".join(st.session_state.pdf_texts.values())
-    # Function to get bot personality icon
-    def get_personality_icon(personality):
-        icons = {
-            "Neutral": "💬",  # Default robot icon
-            "Formal": "📝",   # Scroll icon for formal tone
-            "Casual": "🧑‍💼",   # Smile face for casual tone
-            "Technical": "⚙️",  # Gear icon for technical tone
-        }
-        return icons.get(personality, "💬")  # Default to "Neutral" if undefined
-    # Only show the below sections if documents are uploaded
-    if st.session_state.pdf_texts:
-        # Chat History
+# Page sections
+# Each section is a fragment: using its widgets reruns only that section instead of the whole script.
+# A section that adds to the conversation history reruns the whole app once so the history shows the new entry;
+# its result is kept in session state (last_summary, last_answer) and drawn again after that rerun.
+
+# Conversation history with the PDF export
+@st.fragment
+def history_section():
+    with METRICS.span("ui_run", section="history"):
         st.subheader("Conversation History ⏳")
         with st.expander("Traceback", expanded=True):
-            # Export conversation as PDF
-            # Export conversation as PDF with word wrapping
-            def export_chat_history_as_pdf(chat_history):
-                buffer = BytesIO()
-                c = canvas.Canvas(buffer, pagesize=letter)
-                width, height = letter
-                y = height - 40  # Start at the top of the page, leaving some margin
-                margin = 40
-                line_width = width - 2 * margin  # Adjust line width for margins
-                c.setFont("Helvetica", 12)
-                c.drawString(margin, y, "PDF Chatbot - Conversation History")
-                y -= 30
-                for chat in chat_history:
-                    role = "User" if chat["role"] == "user" else "Bot"
-                    content = chat["content"]
-                    response_time = chat.get("response_time", None)  
-                    if response_time is not None:
-                        content += f" (Response Time: {response_time:.2f} seconds)"     
-                    # Split content into multiple lines based on page width
-                    lines = simpleSplit(content, "Helvetica", 12, line_width)       
-                    c.drawString(margin, y, f"{role}:")
-                    y -= 20
-                    for line in lines:
-                        c.drawString(margin + 20, y, line)  # Indent for content lines
-                        y -= 20
-                        if y < 40:  # Check if we need a new page
-                            c.showPage()
-                            y = height - 40
-                            c.setFont("Helvetica", 12)
-                c.save()
-                buffer.seek(0)
-                return buffer
+            export_format = st.radio(
+                "Export format :", list(EXPORT_FORMATS), format_func=lambda key: EXPORT_FORMATS[key][0], horizontal=True
+            )
             if st.button("Export Chat"):
                 if st.session_state.chat_history:
-                    pdf_buffer = export_chat_history_as_pdf(st.session_state.chat_history)
-                    st.download_button(
-                        label="Download Chat History as PDF",
-                        data=pdf_buffer,
-                        file_name="chat_history.pdf",
-                        mime="application/pdf"
-                    )
+                    start_history_export(export_format)
                 else:
                     st.info("No chat history to export.")
-            if st.session_state.chat_history:
-                for chat in st.session_state.chat_history:
-                    if chat["role"] == "user":
-                        # User bubble with icon 
-                        st.markdown(
-                            f"""
-                            <div style="
-                                display: flex; 
-                                align-items: flex-start; 
-                                margin: 10px 0; 
-                                justify-content: flex-start;">
-                                <div style="
-                                    margin-right: 10px; 
-                                    width: 35px; 
-                                    height: 35px; 
-                                    background-color: #8383eb; 
-                                    display: flex; 
-                                    align-items: center; 
-                                    justify-content: center; 
-                                    border-radius: 50%;">
-                                    <div class="icon">👤</div>
-                                </div>
-                                <div style="
-                                    background-color: #f7f7d2; 
-                                    color: #444; 
-                                    padding: 10px 15px; 
-                                    border-radius: 10px; 
-                                    max-width: 80%;
-                                    font-size: 14px;
-                                    box-shadow: 0 1px 3px rgba(0, 0, 0, 0.1);">
-                                    {chat['content']}
-                                </div>
-                            </div>
-                            """,
-                            unsafe_allow_html=True
-                        )
-                    elif chat["role"] == "bot":
-                        # Get the personality icon based on the saved personality
-                        personality_icon = get_personality_icon(chat.get("personality", "Neutral"))  # Use saved personality here
-                        response_time = chat.get("response_time", "")
-                        # Bot bubble with icon
-                        st.markdown(
-                            f"""
-                            <div style="
-                                display: flex; 
-                                align-items: flex-start; 
-                                margin: 10px 0; 
-                                justify-content: flex-start;">
-                                <div style="
-                                    margin-right: 10px; 
-                                    width: 35px; 
-                                    height: 35px; 
-                                    background-color: #20c997; 
-                                    display: flex; 
-                                    align-items: center; 
-                                    justify-content: center; 
-                                    border-radius: 50%;">
-                                    <div class="icon">🤖</div>
-                                </div>
-                                <div style="
-                                    background-color: #f7f9fc; 
-                                    color: #444; 
-                                    padding: 10px 15px; 
-                                    border-radius: 10px; 
-                                    max-width: 80%;
-                                    font-size: 14px;
-                                    box-shadow: 0 1px 3px rgba(0, 0, 0, 0.1);">
-                                    {chat['content']}<br><span style="font-size: 12px; color: #888;">(Response Time: {response_time:.2f} seconds)</span>
-                                </div>
-                                <div class="icon">{personality_icon}</div>
-                            </div>
-                            """,
-                            unsafe_allow_html=True
-                        )
-                    elif chat["role"] == "summary":
-                        st.markdown(
-                            f"""
-                            <div style="
-                                display: flex; 
-                                align-items: flex-start; 
-                                margin: 10px 0; 
-                                justify-content: flex-start;">
-                                <div style="
-                                    margin-right: 10px; 
-                                    width: 35px; 
-                                    height: 35px; 
-                                    background-color: #f4b400; 
-                                    display: flex; 
-                                    align-items: center; 
-                                    justify-content: center; 
-                                    border-radius: 50%;">
-                                    <div class="icon">📄</div>
-                                </div>
-                                <div style="
-                                    background-color: #f7f9fc; 
-                                    color: #444; 
-                                    padding: 10px 15px; 
-                                    border-radius: 10px; 
-                                    max-width: 80%;
-                                    font-size: 14px;
-                                    box-shadow: 0 1px 3px rgba(0, 0, 0, 0.1);">
-                                    {chat['content']}<br><span style="font-size: 12px; color: #888;">(Response Time: {chat['response_time']:.2f} seconds)</span>
-                                </div>
-                            </div>
-                            """,
-                            unsafe_allow_html=True
-                        )
+            export = st.session_state.get("history_exports", {}).get(export_format)
+            if export is not None and export.running:
+                st.fragment(run_every=EXPORT_POLL_SECONDS)(render_export_status)(export_format, polling=True)
+            else:
+                render_export_status(export_format)
+            chat_history = st.session_state.chat_history
+            if chat_history:
+                # Only the newest entries are drawn; "Load older" widens the window a page at a time
+                visible = min(st.session_state.get("history_visible", HISTORY_PAGE_SIZE), len(chat_history))
+                if visible < len(chat_history):
+                    def load_older():
+                        st.session_state.history_visible = visible + HISTORY_PAGE_SIZE
+                    st.button(f"Load older ({len(chat_history) - visible} more)", on_click=load_older)
+                for entry_html in chat_history.html_window(len(chat_history) - visible, len(chat_history)):
+                    st.markdown(entry_html, unsafe_allow_html=True)
+                if visible > HISTORY_PAGE_SIZE:
+                    def show_latest():
+                        st.session_state.history_visible = HISTORY_PAGE_SIZE
+                    st.button("Show latest only", on_click=show_latest)
             else:
                 st.markdown(
                     """
@@ -462,73 +934,102 @@ def main():
                     </div>
                     """, unsafe_allow_html=True
                 )
-        # --- Inserted Search Section ---
+
+# "page N" for a search hit, noting the tables on the page (a hit there may sit in a table's cells)
+def page_location(page):
+    if page.table_count:
+        return f"page {page.number}, {page.table_count} table{'s' if page.table_count > 1 else ''}"
+    return f"page {page.number}"
+
+# Keyword search over the indexed pages
+@st.fragment
+def search_section():
+    with METRICS.span("ui_run", section="search"):
         st.subheader("Search in Documents 🔍")
-        def search_text_in_pdf(keyword):
-            results = {}
-            for doc_name, text in st.session_state.pdf_texts.items():
-                matches = [line for line in text.splitlines() if keyword.lower() in line.lower()]
-                if matches:
-                    results[doc_name] = matches
-            return results
-        search_query = st.text_input("Enter keyword or phrase to search :")
-        bubble_template = """
-        <div style="
-            background-color: {bg_color}; 
-            color: {text_color}; 
-            padding: 10px 15px; 
-            border-radius: 10px; 
-            box-shadow: 0px 2px 6px rgba(0, 0, 0, 0.1); 
-            margin: 10px 0;
-            font-size: 16px;
-            line-height: 1.6;
-            font-family: Arial, sans-serif;
-            overflow-wrap: break-word;
-            word-break: break-word;
-            white-space: pre-wrap;
-            overflow: auto;
-            max-width: 100%;
-            transition: background-color 0.3s ease, color 0.3s ease;">
-        {content}
-        </div>
-        """
-        # Detect user's theme preference for adaptive styling
-        theme_mode = st.get_option("theme.base")
-        if theme_mode == "dark":
-            bg_color = "#9874f2"  # Dark blue for dark mode
-            text_color = "#ffffff"  # White text for dark mode
-        else:
-            bg_color = "#d3c2fc"  # Pastel blue for light mode
-            text_color = "#000000"  # Black text for light mode
+        search_query = st.text_input('Enter keyword or phrase to search ("quotes" for exact phrases, * for prefixes) :')
         if search_query:
-            search_results = search_text_in_pdf(search_query)
+            search_start = time.time()
+            search_results = st.session_state.search_index.search(search_query)
+            search_ms = (time.time() - search_start) * 1000
+            METRICS.observe("search_seconds", search_ms / 1000)
             if search_results:
-                formatted_results = ", ".join(search_results)  # Combine PDF file names into a single string
-                content = f"**Search Query:** {search_query}<br>**Results in:** {formatted_results}"
-                styled_response = bubble_template.format(
-                    bg_color=bg_color, text_color=text_color, content=content
+                # Ranked hits with page numbers and highlighted snippets
+                formatted_results = "<br>".join(
+                    f"<b>{html.escape(hit['doc'])}</b> ({page_location(hit['page'])}): {hit['snippet']}"
+                    for hit in search_results
                 )
-                st.markdown(styled_response, unsafe_allow_html=True)
+                content = (
+                    f"<b>Search Query:</b> {html.escape(search_query)} "
+                    f"<span style=\"font-size: 12px;\">({len(search_results)} hits in {search_ms:.1f} ms)</span><br>{formatted_results}"
+                )
+                st.markdown(render_bubble("search", content), unsafe_allow_html=True)
             else:
                 st.info("No matching results found.")
-        # Summarize dropdown functionality
-        if st.session_state.pdf_texts:
-            st.subheader("Summarize Documents 📜")
-            selected_doc = st.selectbox("Select a document to summarize :", options=list(st.session_state.pdf_texts.keys()))
-            summary_type = st.radio("Select Summary Type :", ["Short", "Detailed","Tabular"])
-            # Conditional display of "Enable Bullet Points" checkbox
-            bullet_points = False  # Default value
-            if summary_type == "Detailed":
-                bullet_points = st.checkbox("Enable Bullet Points")
-            if st.button("Generate Summary"):
-                doc_text = st.session_state.pdf_texts[selected_doc]
-                summary, elapsed_time = summarize_text(doc_text, summary_type, bullet_points)
+
+# Summaries of fully loaded documents
+@st.fragment
+def summary_section():
+    with METRICS.span("ui_run", section="summary"):
+        loaded_docs = [name for name in st.session_state.pdf_documents if name not in st.session_state.loading_docs]
+        if not loaded_docs:
+            return
+        st.subheader("Summarize Documents 📜")
+        selected_doc = st.selectbox("Select a document to summarize :", options=loaded_docs)
+        summary_type = st.radio("Select Summary Type :", ["Short", "Detailed","Tabular"])
+        # Conditional display of "Enable Bullet Points" checkbox
+        bullet_points = False  # Default value
+        if summary_type == "Detailed":
+            bullet_points = st.checkbox("Enable Bullet Points")
+        if st.button("Generate Summary"):
+            document = st.session_state.pdf_documents[selected_doc]
+            if summary_type == "Tabular" and document.tables:
+                # The tables found at extraction time are the tabular summary; no model round-trip
+                tables_html, elapsed_time = document_tables_html(document)
+                st.session_state.chat_history.append({
+                    "role": "summary",
+                    "content": f"Tables in {selected_doc}: {tables_html}",
+                    "response_time": elapsed_time
+                })
+                st.session_state.last_summary = {"doc": selected_doc, "tables": True}
+                st.rerun()
+            else:
+                # Decoded from the shared store only when a summary is requested
+                summary, elapsed_time = summarize_text(document.text(), summary_type, bullet_points)
                 if summary:
                     st.session_state.chat_history.append({
                         "role": "summary",
                         "content": f"Summary for {selected_doc}: {summary}",
                         "response_time": elapsed_time
                     })
+                    st.session_state.last_summary = {"doc": selected_doc, "content": summary}
+                    st.rerun()
+        # Batch mode: several documents at once, each streaming into its own bubble
+        batch_docs = st.multiselect("Or summarize several documents at once (leave empty for all) :", options=loaded_docs)
+        job = st.session_state.get("batch_summary_job")
+        if st.button(
+            f"Summarize {len(batch_docs) or 'all'} documents", key="batch-summarize", disabled=job is not None and job.active
+        ):
+            docs = [(name, st.session_state.pdf_documents[name]) for name in batch_docs or loaded_docs]
+            job = st.session_state.batch_summary_job = BatchSummaryJob(
+                docs, summary_type, bullet_points, st.session_state.get("session_id", "local")
+            )
+        if job is not None:
+            if job.active:
+                st.fragment(run_every=BATCH_POLL_SECONDS)(render_batch_summary)(polling=True)
+            else:
+                render_batch_summary()
+        # The latest summary stays on screen below the controls
+        last_summary = st.session_state.get("last_summary")
+        if last_summary and last_summary["doc"] in st.session_state.pdf_documents:
+            if last_summary.get("tables"):
+                show_document_tables(last_summary["doc"], st.session_state.pdf_documents[last_summary["doc"]])
+            else:
+                st.markdown(render_bubble("summary", last_summary["content"]), unsafe_allow_html=True)
+
+# Personality choice and questions about the documents
+@st.fragment
+def chat_section(warm_up_status):
+    with METRICS.span("ui_run", section="chat"):
         # Dropdown for bot personality
         st.subheader("Choose Bot Personality 🎭")
         st.session_state.selected_personality = st.selectbox(
@@ -539,35 +1040,204 @@ def main():
         # Chat History section: Includes User and Bot chat bubbles with icons
         st.subheader("Chat with Documents 💭")
         # Ask question section
-        if st.session_state.pdf_texts:
-            # Use text_area for multiline input to handle Shift+Enter
-            question = st.text_area("Ask a question about the documents (Shift+Enter for new line) :", height=150)
-            # When the user submits a question, save the selected personality with the response
-            if st.button("Submit Question"):
-                st.write("Getting answer from LLaMA...")
-                answer, response_time = ask_llama_question(combined_text, question)
-                if answer:
-                    st.session_state.chat_history.append({
-                        "role": "user", 
-                        "content": question
-                    })
-                    st.session_state.chat_history.append({
-                        "role": "bot", 
-                        "content": answer,
-                        "response_time": response_time,
-                        "personality": st.session_state.selected_personality  # Save the personality here
-                    })
-                    # Check for tabular/comparison keywords and offer CSV download
-                    csv_data = detect_and_save_csv(answer)
-                    if csv_data:
-                        # Provide CSV download button
-                        st.download_button(
-                            label="Download CSV",
-                            data=csv_data,
-                            file_name="comparison_data.csv",
-                            mime="text/csv"
-                        )
+        if not st.session_state.retrieval_index:
+            return
+        # Use text_area for multiline input to handle Shift+Enter
+        question = st.text_area("Ask a question about the documents (Shift+Enter for new line) :", height=150)
+        # When the user submits a question, save the selected personality with the response
+        if st.button("Submit Question"):
+            st.write("Getting answer from LLaMA...")
+            # Answers are only cached once every uploaded document is fully indexed
+            doc_fingerprint = None
+            if not st.session_state.ingestion_job.active:
+                doc_fingerprint = document_fingerprint(st.session_state.pdf_hashes.values())
+            answer, response_time, saved_time = ask_llama_question(
+                st.session_state.retrieval_index, question, doc_fingerprint
+            )
+            if answer:
+                st.session_state.chat_history.append({
+                    "role": "user",
+                    "content": question
+                })
+                st.session_state.chat_history.append({
+                    "role": "bot",
+                    "content": answer,
+                    "response_time": response_time,
+                    "personality": st.session_state.selected_personality,  # Save the personality here
+                    "cache_hit": saved_time is not None,
+                    "saved_time": saved_time
+                })
+                notes = st.session_state.pop("answer_notes", [])
+                # Time to first token: first answered question versus the later ones
+                ttft_log = [ttft for ttft in st.session_state.get("ttft_log", []) if ttft is not None]
+                if ttft_log:
+                    ttft_note = f"Time to first token - first question: {ttft_log[0]:.2f} s"
+                    if len(ttft_log) > 1:
+                        ttft_note += f", later questions (avg): {sum(ttft_log[1:]) / len(ttft_log[1:]):.2f} s"
+                    if warm_up_status["seconds"] is not None:
+                        ttft_note += f" | Model warm-up: {warm_up_status['state']} in {warm_up_status['seconds']:.2f} s"
+                    notes.append(ttft_note)
+                # The source tables behind the answer, straight from the extracted cells
+                matching_tables = st.session_state.retrieval_index.search_tables(question)
+                st.session_state.last_answer = {
+                    "content": answer,
+                    "notes": notes,
+                    "tables": matching_tables,
+                    # Otherwise check for tabular/comparison keywords and rebuild a table from the answer
+                    "csv": None if matching_tables else detect_and_save_csv(answer),
+                }
+                st.rerun()
+        # The latest answer stays on screen with its notes and downloads
+        last_answer = st.session_state.get("last_answer")
+        if last_answer:
+            st.markdown(render_bubble("answer", last_answer["content"]), unsafe_allow_html=True)
+            for note in last_answer["notes"]:
+                st.caption(note)
+            for position, (doc_name, table) in enumerate(last_answer["tables"], start=1):
+                st.download_button(
+                    label=f"Download CSV ({doc_name}, page {table['page']})",
+                    data=table_csv(table),
+                    file_name=table_file_name(doc_name, table, position),
+                    mime="text/csv",
+                    key=f"answer-table-{position}",
+                )
+            if last_answer["csv"]:
+                # Provide CSV download button
+                st.download_button(
+                    label="Download CSV",
+                    data=last_answer["csv"],
+                    file_name="comparison_data.csv",
+                    mime="text/csv"
+                )
+
+#-------------------------------------------
+# Streamlit interface
+def main():
+    st.title("Chat with PDF Documents 🗂️")
+    warm_up_status = warm_up_model()
+    # Live performance metrics for capacity planning
+    with st.sidebar.expander("Performance metrics 📈"):
+        metric_rows = METRICS.snapshot()
+        if metric_rows:
+            # A markdown table, so showing the sidebar does not import pandas
+            st.markdown("| Metric | Labels | Count | Mean | p50 | p95 |\n|---|---|---|---|---|---|\n" + "\n".join(
+                f"| {row['metric']} | {row['labels']} | {row['count']} | "
+                + " | ".join("" if row[column] is None else f"{row[column]:.4g}" for column in ("mean", "p50", "p95")) + " |"
+                for row in metric_rows
+            ))
+            st.download_button("Download Prometheus metrics", METRICS.prometheus_text(), file_name="metrics.prom", mime="text/plain")
+        else:
+            st.caption("No measurements yet.")
+        doc_count, doc_bytes = DOCUMENT_STORE.stats()
+        st.caption(f"Shared document store: {doc_count} documents, {doc_bytes / 1e6:.1f} MB memory-mapped")
+        pool_stats = get_client_pool().stats()
+        st.caption(f"Ollama queue: {pool_stats['queue_depth']} waiting | " + ", ".join(
+            f"{endpoint['endpoint']}: {endpoint['in_flight']}/{endpoint['max_concurrency']} busy"
+            for endpoint in pool_stats["endpoints"]
+        ))
+    # Clear button moved to the top
+    def clear_all():
+        st.session_state.uploaded_files = []
+        st.session_state.chat_history = new_chat_history()
+        st.session_state.pop("history_visible", None)
+        st.session_state.pop("history_exports", None)  # Their temporary files are removed with them
+        if st.session_state.get("batch_summary_job") is not None:
+            st.session_state.batch_summary_job.cancelled = True  # Skip documents that have not started yet
+            st.session_state.batch_summary_job = None
+        st.session_state.pop("last_summary", None)
+        st.session_state.pop("last_answer", None)
+        st.session_state.pdf_documents = {}
+        st.session_state.loading_docs = set()
+        st.session_state.pdf_hashes = {}
+        st.session_state.upload_hashes = {}
+        st.session_state.failed_uploads = set()
+        st.session_state.retrieval_index = RetrievalIndex()
+        st.session_state.search_index = SearchIndex()
+        st.session_state.ingestion_job.cancelled = True  # Stop extracting documents that are still loading
+        st.session_state.ingestion_job = IngestionJob()
+        st.session_state.ingest_messages = []
+        st.session_state.clear_flag = True  # Mark that the chat was cleared
+    st.button("Clear All", on_click=clear_all)
+    # Initialize session state for uploaded files, chat history, and PDF texts if not present
+    if 'uploaded_files' not in st.session_state:
+        st.session_state.uploaded_files = []
+    if 'chat_history' not in st.session_state:
+        st.session_state.chat_history = new_chat_history()
+    if 'pdf_documents' not in st.session_state:
+        st.session_state.pdf_documents = {}  # Document name -> StoredDocument (a reference into the shared store)
+    if 'loading_docs' not in st.session_state:
+        st.session_state.loading_docs = set()  # Documents whose pages are still being extracted
+    if 'pdf_hashes' not in st.session_state:
+        st.session_state.pdf_hashes = {}  # Document name -> SHA-256 of its PDF bytes
+    if 'upload_hashes' not in st.session_state:
+        st.session_state.upload_hashes = {}  # Uploader file id -> SHA-256, so files are hashed only once
+    if 'failed_uploads' not in st.session_state:
+        st.session_state.failed_uploads = set()  # Uploader file ids whose extraction failed
+    if 'retrieval_index' not in st.session_state:
+        st.session_state.retrieval_index = RetrievalIndex()
+    if 'search_index' not in st.session_state:
+        st.session_state.search_index = SearchIndex()
+    if 'ingestion_job' not in st.session_state:
+        st.session_state.ingestion_job = IngestionJob()
+    if 'ingest_messages' not in st.session_state:
+        st.session_state.ingest_messages = []  # (level, message) errors and warnings from the latest uploads
+    if 'clear_flag' not in st.session_state:
+        st.session_state.clear_flag = False  # Flag to track if chat was cleared
+    if 'session_id' not in st.session_state:
+        st.session_state.session_id = uuid.uuid4().hex  # Fair-share key in the shared Ollama queue
+    if 'selected_personality' not in st.session_state:
+        st.session_state.selected_personality = "Neutral"  # Default personality
+    # Allow multiple PDF uploads
+    st.subheader("Upload PDFs 🖨️")
+    uploaded_files = st.file_uploader("Click on Browse Files to choose the PDFs to be uploaded :",type="pdf", accept_multiple_files=True)
+    if uploaded_files:
+        # Deduplicate by content hash so same-named files never collide and re-uploads are skipped
+        loaded_hashes = set(st.session_state.pdf_hashes.values())
+        new_files = []
+        for file in uploaded_files:
+            if file.file_id in st.session_state.failed_uploads:
+                continue
+            if file.file_id not in st.session_state.upload_hashes:
+                st.session_state.upload_hashes[file.file_id] = hash_pdf_bytes(file.getvalue())
+            content_hash = st.session_state.upload_hashes[file.file_id]
+            if content_hash not in loaded_hashes:
+                loaded_hashes.add(content_hash)
+                new_files.append(file)
+        if new_files:
+            # Extract the new PDFs in the background; pages are merged into the session as they arrive
+            docs = []
+            if not st.session_state.ingestion_job.active:
+                st.session_state.ingest_messages = []  # A fresh batch starts with no messages
+            for file in new_files:
+                name = unique_doc_name(file.name, st.session_state.pdf_hashes)
+                st.session_state.pdf_hashes[name] = st.session_state.upload_hashes[file.file_id]
+                docs.append((name, st.session_state.pdf_hashes[name], file.getvalue()))
+            st.session_state.ingestion_job.submit(docs)
+            st.session_state.ingest_announce = True
+    # Show live per-page progress, refreshing only this panel while documents are loading
+    if st.session_state.ingestion_job.active:
+        st.fragment(run_every=INGEST_POLL_SECONDS)(render_ingestion_progress)()
+    else:
+        render_ingestion_progress()
+    if st.session_state.pop("ingest_success", False):
+        st.success("All PDFs have been processed. ✅")
+    # How much of the uploaded text repeats itself (e.g. several revisions of the same contract)
+    duplicate_stats = st.session_state.retrieval_index.duplicate_stats()
+    if duplicate_stats["duplicate_tokens"]:
+        st.caption(
+            f"♻️ Near-duplicate content: {duplicate_stats['duplicate_share']:.0%} of the uploaded text "
+            f"({duplicate_stats['duplicate_tokens']} of {duplicate_stats['tokens']} tokens, {duplicate_stats['groups']} shared passages) "
+            "repeats earlier passages; each shared passage is sent to the model once."
+        )
+    # Only show the below sections if documents are uploaded (or are already partly indexed)
+    if st.session_state.pdf_documents:
+        history_section()
+        search_section()
+        summary_section()
+        chat_section(warm_up_status)
 #-------------------------------------------
 # Run the main app
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    # Full-script run time (fragment reruns are measured per section)
+    with METRICS.span("ui_run", section="app"):
+        main()
\ No newline at end of file
@@ -0,0 +1,171 @@
+# Headless batch question answering over a directory of PDFs
+# Every PDF in --pdf-dir is extracted (through the shared extraction cache) and indexed once. The questions in
+# --questions are then answered through a ClientPool with at most --workers-per-endpoint requests in flight on
+# each Ollama endpoint; a request goes to the endpoint with the least outstanding work, so throughput grows with
+# the number of backends.
+# Results are appended to --output as they finish, one JSON object per line with per-item timings.
+#
+# Questions file: one JSON object per line, e.g. {"id": "q1", "question": "What is the total?", "personality": "Formal"}
+# ("id" defaults to the line number and "personality" to --personality; a bare JSON string is also accepted)
+#
+# Usage: python batch_qa.py --pdf-dir docs/ --questions questions.jsonl --output answers.jsonl \
+#            --endpoints http://gpu1:11434 http://gpu2:11434 --workers-per-endpoint 2
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from client_pool import ClientPool
+from core import (
+    LLM_MODEL, OLLAMA_KEEP_ALIVE, OLLAMA_OPTIONS, PERSONALITY_TONES, RetrievalIndex, StreamCollector, answer_question,
+    document_fingerprint, extract_document,
+)
+from metrics import METRICS
+#-------------------------------------------
+EXTRACT_FILE_WORKERS = 4  # PDFs extracted at the same time while loading the corpus
+
+# Progress messages go to stderr so --output can be stdout
+def log(message):
+    print(message, file=sys.stderr, flush=True)
+
+# Extract and index every PDF in a directory; returns the index and the fingerprint of the document set
+def load_corpus(pdf_dir):
+    paths = sorted(
+        os.path.join(pdf_dir, name) for name in os.listdir(pdf_dir) if name.lower().endswith(".pdf")
+    )
+    if not paths:
+        raise SystemExit(f"No PDF files found in {pdf_dir}")
+    def extract(path):
+        with open(path, "rb") as f:
+            return (os.path.basename(path),) + extract_document(f.read())
+    retrieval_index = RetrievalIndex()
+    content_hashes = []
+    with ThreadPoolExecutor(max_workers=EXTRACT_FILE_WORKERS) as executor:
+        # map() keeps directory order, so chunk ids (and prompts) are the same on every run
+        for doc_name, content_hash, pages, tables in executor.map(extract, paths):
+            retrieval_index.add_document(doc_name, pages, tables)
+            content_hashes.append(content_hash)
+            log(f"Indexed {doc_name}: {len(pages)} pages, {len(tables)} tables")
+    duplicate_stats = retrieval_index.duplicate_stats()
+    if duplicate_stats["duplicate_tokens"]:
+        log(f"Near-duplicate content: {duplicate_stats['duplicate_share']:.0%} of the corpus "
+            f"({duplicate_stats['duplicate_tokens']} tokens in {duplicate_stats['groups']} shared passages)")
+    return retrieval_index, document_fingerprint(content_hashes)
+
+# Generator over the question items in a JSONL file; blank lines are skipped
+def read_questions(path):
+    with open(path) as f:
+        for line_num, line in enumerate(f, start=1):
+            if not line.strip():
+                continue
+            item = json.loads(line)
+            if isinstance(item, str):
+                item = {"question": item}
+            item.setdefault("id", line_num)
+            yield item
+
+# Answer one question through the pool and return its result record
+def answer_item(item, pool, retrieval_index, doc_fingerprint, default_personality):
+    started_at = time.time()
+    personality = item.get("personality", default_personality)
+    record = {"id": item["id"], "question": item["question"], "personality": personality}
+    # Each question is its own fair-share session, so questions are served in file order
+    client = pool.session(item["id"])
+    try:
+        sink = StreamCollector("answer", started_at)
+        answer, elapsed_time, saved_time = answer_question(
+            retrieval_index, item["question"], PERSONALITY_TONES.get(personality, PERSONALITY_TONES["Neutral"]),
+            doc_fingerprint, sink=sink, client=client,
+        )
+        final = sink.final_chunk or {}
+        request = client.last_request  # None for cache hits
+        record.update({
+            "endpoint": request.endpoint if request else None,
+            "answer": answer,
+            "error": None,
+            "cache_hit": saved_time is not None,
+            "notices": sink.notices,
+            "prompt_tokens": final.get("prompt_eval_count"),
+            "completion_tokens": final.get("eval_count"),
+            "dedup_saved_tokens": sink.context_saved_tokens,
+            "timings": {
+                "queue_wait_s": request.wait_seconds if request else 0.0,
+                "ttft_s": sink.ttft,
+                "total_s": elapsed_time,
+                "tokens_per_second": sink.tokens_per_second,
+            },
+        })
+    except Exception as e:
+        record.update({"endpoint": client.last_request.endpoint if client.last_request else None,
+                       "answer": None, "error": str(e), "timings": {"total_s": time.time() - started_at}})
+    return record
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Answer a file of questions about a directory of PDFs")
+    parser.add_argument("--pdf-dir", required=True, help="directory with the PDF documents")
+    parser.add_argument("--questions", required=True, help="JSONL file with one question per line")
+    parser.add_argument("--output", default="-", help="JSONL file for the answers ('-' for stdout)")
+    parser.add_argument("--endpoints", nargs="+", default=[os.environ.get("OLLAMA_HOST", "http://127.0.0.1:11434")],
+                        help="Ollama base URLs to spread the questions over")
+    parser.add_argument("--workers-per-endpoint", type=int, default=2, help="requests in flight on each endpoint")
+    parser.add_argument("--personality", default="Neutral", choices=sorted(PERSONALITY_TONES))
+    parser.add_argument("--no-cache", action="store_true", help="always ask the model instead of the response cache")
+    parser.add_argument("--no-warm-up", action="store_true", help="skip loading the model before the first question")
+    args = parser.parse_args(argv)
+
+    load_start = time.time()
+    retrieval_index, doc_fingerprint = load_corpus(args.pdf_dir)
+    log(f"Corpus ready in {time.time() - load_start:.2f} s ({len(retrieval_index)} chunks)")
+    if args.no_cache:
+        doc_fingerprint = None
+
+    pool = ClientPool(args.endpoints, args.workers_per_endpoint)
+    if not args.no_warm_up:
+        # Load the model on every endpoint at once so the first questions do not pay for a cold start
+        warm_up_start = time.time()
+        results = pool.broadcast("generate", model=LLM_MODEL, prompt="", options=OLLAMA_OPTIONS, keep_alive=OLLAMA_KEEP_ALIVE)
+        for endpoint, result in zip(args.endpoints, results):
+            log(f"Warm-up failed on {endpoint}: {result}" if isinstance(result, Exception)
+                else f"Model ready on {endpoint} in {time.time() - warm_up_start:.2f} s")
+    # Twice the pool's capacity in threads, so the next requests are already queued when a slot frees up
+    workers = 2 * len(args.endpoints) * max(args.workers_per_endpoint, 1)
+
+    output = sys.stdout if args.output == "-" else open(args.output, "a")
+    answered = failed = 0
+    run_start = time.time()
+    try:
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="batch-qa") as executor:
+            in_flight = set()
+            def write_done(done):
+                nonlocal answered, failed
+                for future in done:
+                    record = future.result()
+                    output.write(json.dumps(record) + "\n")
+                    output.flush()
+                    answered += 1
+                    failed += record["error"] is not None
+            # Read questions only as threads free up instead of loading the whole file up front
+            for item in read_questions(args.questions):
+                if len(in_flight) >= workers:
+                    done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                    write_done(done)
+                in_flight.add(executor.submit(answer_item, item, pool, retrieval_index, doc_fingerprint, args.personality))
+            write_done(wait(in_flight).done)
+    finally:
+        if output is not sys.stdout:
+            output.close()
+    elapsed = time.time() - run_start
+    log(json.dumps({
+        "questions": answered,
+        "errors": failed,
+        "endpoints": len(args.endpoints),
+        "workers": workers,
+        "elapsed_s": elapsed,
+        "questions_per_second": answered / elapsed if elapsed > 0 else 0.0,
+        "metrics": [row for row in METRICS.snapshot()
+                    if row["metric"] in ("response_seconds", "ttft_seconds", "pool_queue_wait_seconds")],
+    }))
+
+if __name__ == "__main__":
+    main()
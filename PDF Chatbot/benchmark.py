@@ -0,0 +1,332 @@
+# Headless benchmark for the PDF chatbot
+# Generates a synthetic PDF corpus with reportlab, starts a local stand-in for the Ollama chat API
+# that streams tokens at a fixed rate, and times the app's hot paths. Results are printed as JSON.
+#
+# Usage: python benchmark.py --docs 5 --pages 40 --table-density 0.3 --token-rate 200 --output bench.json
+import argparse
+import io
+import json
+import logging
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from reportlab.lib import colors
+from reportlab.lib.pagesizes import letter
+from reportlab.lib.styles import getSampleStyleSheet
+from reportlab.platypus import PageBreak, Paragraph, SimpleDocTemplate, Table, TableStyle
+#-------------------------------------------
+# Synthetic corpus
+WORDS = (
+    "revenue margin contract clause payment invoice quarter growth forecast supplier delivery warranty "
+    "liability audit budget region product customer service report analysis policy risk compliance "
+    "schedule milestone approval vendor pricing discount renewal termination agreement annual monthly"
+).split()
+
+# Random sentence-like text of roughly word_count words
+def random_text(rng, word_count):
+    words = [rng.choice(WORDS) for _ in range(word_count)]
+    sentences = [" ".join(words[i:i + 12]).capitalize() + "." for i in range(0, len(words), 12)]
+    return " ".join(sentences)
+
+# Build one synthetic PDF; table_density is the chance that a page carries a table
+# With edit_rng, about edit_rate of the words are replaced (a revision of the PDF the same rng state would produce)
+def generate_pdf(rng, pages, words_per_page, table_density, edit_rng=None, edit_rate=0.02):
+    buffer = io.BytesIO()
+    styles = getSampleStyleSheet()
+    story = []
+    for page_num in range(pages):
+        text = random_text(rng, words_per_page)
+        if edit_rng:
+            text = " ".join(edit_rng.choice(WORDS) if edit_rng.random() < edit_rate else word for word in text.split())
+        story.append(Paragraph(f"Section {page_num + 1}", styles["Heading2"]))
+        story.append(Paragraph(text, styles["BodyText"]))
+        if rng.random() < table_density:
+            rows = [["Item", "Region", "Q1", "Q2"]]
+            rows += [[rng.choice(WORDS), rng.choice(WORDS), str(rng.randint(10, 999)), str(rng.randint(10, 999))]
+                     for _ in range(6)]
+            # Ruled, like most report tables, so the extractor's table finder can see the grid
+            story.append(Table(rows, style=TableStyle([("GRID", (0, 0), (-1, -1), 0.5, colors.grey)])))
+        story.append(PageBreak())
+    SimpleDocTemplate(buffer, pagesize=letter).build(story)
+    return buffer.getvalue()
+
+#-------------------------------------------
+# Mock Ollama server: streams answer_tokens tokens at token_rate tokens per second
+def start_mock_ollama(token_rate, answer_tokens):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def _send_json_lines(self, lines, stream):
+            self.send_response(200)
+            self.send_header("Content-Type", "application/x-ndjson" if stream else "application/json")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            for line in lines:
+                data = (json.dumps(line) + "\n").encode()
+                self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+                self.wfile.flush()
+            self.wfile.write(b"0\r\n\r\n")
+
+        def do_POST(self):
+            request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            if self.path == "/api/embed":
+                inputs = request.get("input") or []
+                inputs = [inputs] if isinstance(inputs, str) else inputs
+                self._send_json_lines([{"model": request.get("model"), "embeddings": [[1.0, 0.0] for _ in inputs]}], False)
+                return
+            prompt_chars = sum(len(m.get("content", "")) for m in request.get("messages", [])) + len(request.get("prompt", ""))
+            done = {
+                "model": request.get("model"), "done": True, "done_reason": "stop",
+                "prompt_eval_count": prompt_chars // 4, "eval_count": answer_tokens,
+                "prompt_eval_duration": 0, "eval_duration": int(answer_tokens / token_rate * 1e9),
+                "load_duration": 0, "total_duration": int(answer_tokens / token_rate * 1e9),
+            }
+            if self.path == "/api/generate":
+                self._send_json_lines([dict(done, response="")], False)
+                return
+            tokens = [f"token{i} " for i in range(answer_tokens)]
+            if not request.get("stream", True):
+                message = {"role": "assistant", "content": "".join(tokens)}
+                self._send_json_lines([dict(done, message=message)], False)
+                return
+            def lines():
+                for token in tokens:
+                    time.sleep(1 / token_rate)
+                    yield {"model": request.get("model"), "done": False, "message": {"role": "assistant", "content": token}}
+                yield dict(done, message={"role": "assistant", "content": ""})
+            self._send_json_lines(lines(), True)
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+#-------------------------------------------
+# Regression check for table extraction: cropping a page to its drawings must not lose columns
+# Returns (document, page, cropped column counts, uncropped column counts) for every page where they differ
+def table_column_mismatches(pdfs):
+    import fitz  # PyMuPDF
+    from extraction import extract_page_tables
+    mismatches = []
+    for name, data in pdfs:
+        with fitz.open(stream=data, filetype="pdf") as pdf_document:
+            for page in pdf_document:
+                cropped = [len(table["header"]) for table in extract_page_tables(page)]
+                uncropped = [table.col_count for table in page.find_tables().tables]
+                if cropped != uncropped:
+                    mismatches.append((name, page.number + 1, cropped, uncropped))
+    return mismatches
+
+# Run fn repeats times and summarize the wall-clock durations
+def time_stage(fn, repeats):
+    durations = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        durations.append(time.perf_counter() - start)
+    return {
+        "runs": repeats,
+        "mean_s": statistics.fmean(durations),
+        "median_s": statistics.median(durations),
+        "min_s": min(durations),
+        "max_s": max(durations),
+    }
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Offline benchmark for the PDF chatbot")
+    parser.add_argument("--docs", type=int, default=5, help="number of synthetic PDFs")
+    parser.add_argument("--pages", type=int, default=40, help="pages per PDF")
+    parser.add_argument("--words-per-page", type=int, default=350)
+    parser.add_argument("--table-density", type=float, default=0.3, help="probability that a page has a table")
+    parser.add_argument("--revisions", type=int, default=1, help="lightly edited copies of the first PDF")
+    parser.add_argument("--token-rate", type=float, default=200.0, help="mock model tokens per second")
+    parser.add_argument("--answer-tokens", type=int, default=120, help="tokens in each mock answer")
+    parser.add_argument("--chat-turns", type=int, default=200, help="chat history size for the export benchmark")
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write the JSON report here instead of stdout")
+    args = parser.parse_args(argv)
+
+    server = start_mock_ollama(args.token_rate, args.answer_tokens)
+    cache_dir = tempfile.mkdtemp(prefix="pdf-chatbot-bench-")
+    # The app reads these at import time
+    os.environ["OLLAMA_HOST"] = f"http://127.0.0.1:{server.server_address[1]}"
+    os.environ["PDF_CHATBOT_CACHE_DIR"] = cache_dir
+    logging.getLogger("streamlit").setLevel(logging.ERROR)
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import app
+    import core
+
+    rng = random.Random(args.seed)
+    corpus_start = time.perf_counter()
+    pdfs = [(f"doc{i}.pdf", generate_pdf(rng, args.pages, args.words_per_page, args.table_density)) for i in range(args.docs)]
+    # Revisions replay the first PDF's random stream with a few words changed, so they are near-duplicates of it
+    edit_rng = random.Random(args.seed + 1)
+    pdfs += [
+        (f"doc0-rev{i + 1}.pdf", generate_pdf(random.Random(args.seed), args.pages, args.words_per_page, args.table_density, edit_rng))
+        for i in range(args.revisions)
+    ]
+    corpus_seconds = time.perf_counter() - corpus_start
+
+    results = {}
+    extraction_cache = core.get_extraction_cache()
+    content_hashes = {name: core.hash_pdf_bytes(data) for name, data in pdfs}
+    # Ingestion as the app runs it: the background job extracts every upload page by page into the document store
+    # Returns (name, content hash, page texts, tables) in corpus order; the text is copied out, so the documents
+    # leave the shared store and the next run extracts again instead of reusing them
+    def ingest():
+        job = app.IngestionJob()
+        job.submit([(name, content_hashes[name], data) for name, data in pdfs])
+        while job.active:
+            time.sleep(0.01)
+        _, _, finished, errors = job.drain()
+        if errors:
+            raise RuntimeError(f"Ingestion failed: {errors}")
+        documents = dict(finished)
+        ingested = []
+        for name, _ in pdfs:
+            document = documents[name]
+            pages = [document.page_text(page_num) for page_num in range(1, document.page_count + 1)]
+            ingested.append((name, content_hashes[name], pages, document.tables))
+        return ingested
+    # Cold extraction: clear the on-disk cache before every run
+    def extract_cold():
+        extraction_cache.clear()
+        return ingest()
+    results["extract_cold"] = time_stage(extract_cold, args.repeats)
+    extracted = ingest()
+    results["extract_cached"] = time_stage(ingest, args.repeats)
+
+    checks = {"table_column_mismatches": table_column_mismatches(pdfs)}
+
+    # Indexing
+    def build_indexes():
+        retrieval_index, search_index = core.RetrievalIndex(embedding_model=""), app.SearchIndex()
+        for name, _, pages, tables in extracted:
+            retrieval_index.add_document(name, pages, tables)
+            search_index.set_document(name, retrieval_index.documents[name])
+            search_index.index_pages(name, len(pages))
+        return retrieval_index, search_index
+    results["index_build"] = time_stage(build_indexes, args.repeats)
+    retrieval_index, search_index = build_indexes()
+    # Another session loading the same documents only links their shared indexes
+    def link_indexes():
+        session_index, session_search = core.RetrievalIndex(embedding_model=""), app.SearchIndex()
+        for name, document in retrieval_index.documents.items():
+            session_index.set_document(name, document)
+            session_index.index_pages(name, document.page_count)
+            session_search.set_document(name, document)
+            session_search.index_pages(name, document.page_count)
+        return session_index, session_search
+    results["index_link"] = time_stage(link_indexes, args.repeats)
+
+    # Search: term, phrase and prefix queries
+    queries = ["revenue", '"payment invoice"', "renew*", "contract liability audit"]
+    results["search"] = time_stage(lambda: [search_index.search(query) for query in queries], args.repeats)
+
+    # Table lookups served from the extracted tables (typed frames are rebuilt on every run)
+    def table_lookup():
+        core._table_frames.clear()
+        matches = retrieval_index.search_tables("Q1 revenue by region")
+        return [core.table_frames(retrieval_index.documents[name]) for name, _ in matches]
+    results["table_lookup"] = time_stage(table_lookup, args.repeats)
+
+    # Prompt construction for a question
+    question = "What does the agreement say about payment and renewal?"
+    tone = core.PERSONALITY_TONES["Neutral"]
+    results["prompt_build"] = time_stage(
+        lambda: core.build_question_messages(retrieval_index, question, tone), args.repeats
+    )
+    messages = core.build_question_messages(retrieval_index, question, tone)
+
+    # Streaming answers and summaries against the mock model (caches cleared so every run hits the model)
+    results["ask_llama_question"] = time_stage(lambda: app.ask_llama_question(retrieval_index, question), args.repeats)
+    doc_text = "".join(extracted[0][2])
+    def summarize():
+        core.get_summary_cache().clear()
+        return app.summarize_text(doc_text, "Detailed", True)
+    results["summarize_text"] = time_stage(summarize, args.repeats)
+    # Every document at once, through the batch worker pool and its in-flight cap
+    def summarize_all():
+        core.get_summary_cache().clear()
+        job = app.BatchSummaryJob(list(retrieval_index.documents.items()), "Short", False, "bench")
+        while job.active:
+            time.sleep(0.01)
+        return job
+    results["summarize_all"] = time_stage(summarize_all, args.repeats)
+
+    # Chat history export
+    chat_history = app.new_chat_history()
+    for turn in range(args.chat_turns // 2):
+        chat_history.append({"role": "user", "content": random_text(rng, 20)})
+        chat_history.append({"role": "bot", "content": random_text(rng, 120), "response_time": 1.0})
+    # Each format from scratch, then after two more turns (only the new turns are written or wrapped)
+    from history_export import EXPORT_FORMATS, HistoryExport
+    for export_format in EXPORT_FORMATS:
+        def export_full():
+            export = HistoryExport(export_format)
+            export.start(chat_history)
+            export.wait()
+            return export
+        results[f"export_{export_format}"] = time_stage(export_full, args.repeats)
+        export = export_full()
+        def export_incremental():
+            chat_history.append({"role": "user", "content": random_text(rng, 20)})
+            chat_history.append({"role": "bot", "content": random_text(rng, 120), "response_time": 1.0})
+            export.start(chat_history)
+            export.wait()
+        results[f"export_{export_format}_incremental"] = time_stage(export_incremental, args.repeats)
+
+    # Cold start: importing the app in a fresh interpreter
+    app_dir = os.path.dirname(os.path.abspath(app.__file__))
+    results["startup_import"] = time_stage(
+        lambda: subprocess.run([sys.executable, "-c", "import app"], cwd=app_dir, check=True, capture_output=True), args.repeats
+    )
+    # Full page render with the corpus and chat history loaded; the ui_run_seconds metrics in the report break it
+    # down per section (a widget change inside a section reruns only that section)
+    from streamlit.testing.v1 import AppTest
+    page = AppTest.from_file(app.__file__, default_timeout=120)
+    page.session_state.retrieval_index = retrieval_index
+    page.session_state.search_index = search_index
+    page.session_state.pdf_documents = dict(retrieval_index.documents)
+    page.session_state.pdf_hashes = {name: content_hash for name, content_hash, _, _ in extracted}
+    page.session_state.chat_history = chat_history
+    results["ui_full_run"] = time_stage(page.run, args.repeats)
+
+    report = {
+        "config": vars(args),
+        "corpus": {
+            "documents": len(pdfs),
+            "pages": sum(len(pages) for _, _, pages, _ in extracted),
+            "tables": sum(len(tables) for _, _, _, tables in extracted),
+            "pdf_bytes": sum(len(data) for _, data in pdfs),
+            "generation_s": corpus_seconds,
+            "prompt_chars": sum(len(message["content"]) for message in messages),
+            "duplicate_share": retrieval_index.duplicate_stats()["duplicate_share"],
+        },
+        "environment": {"python": platform.python_version(), "platform": platform.platform(), "cpus": os.cpu_count()},
+        "results": results,
+        "checks": checks,
+        "metrics": app.METRICS.snapshot(),
+    }
+    server.shutdown()
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+    else:
+        print(output)
+    if any(checks.values()):
+        sys.exit(f"Benchmark checks failed: {json.dumps(checks)}")
+
+if __name__ == "__main__":
+    main()
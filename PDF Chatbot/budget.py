@@ -0,0 +1,97 @@
+# Token budgeting for Ollama calls
+# TOKEN_COUNTER estimates token counts from character counts and calibrates its ratio against the prompt token
+# counts Ollama reports. ContextBudget sizes one call to the model's context window: it reserves room for the
+# fixed prompt parts and the answer, packs content until the window is full and records what had to be left out.
+import os
+import threading
+#-------------------------------------------
+# Budget settings (can be overridden through environment variables)
+ANSWER_TOKENS_RESERVE = int(os.environ.get("PDF_CHATBOT_ANSWER_TOKENS", 1024))  # Also passed to Ollama as num_predict
+MESSAGE_OVERHEAD_TOKENS = 8  # Chat template tokens around each message
+SAFETY_MARGIN = 0.05  # Share of the window kept free for estimation error
+
+class TokenCounter:
+    def __init__(self, chars_per_token=4.0, smoothing=0.1, bounds=(2.0, 6.0)):
+        self.chars_per_token = chars_per_token
+        self.smoothing = smoothing
+        self.bounds = bounds
+        self._lock = threading.Lock()
+
+    def count(self, text):
+        return int(len(text) / self.chars_per_token) + 1
+
+    def count_messages(self, messages):
+        return sum(self.count(message["content"]) + MESSAGE_OVERHEAD_TOKENS for message in messages)
+
+    # Characters that fit in a number of tokens
+    def chars_for(self, tokens):
+        return max(int(tokens * self.chars_per_token), 1)
+
+    # Move the ratio towards an observed (prompt characters, prompt tokens) pair
+    # Observations outside the bounds are ignored: they come from prompts whose prefix Ollama served from its cache
+    def calibrate(self, chars, tokens):
+        if not chars or not tokens:
+            return
+        ratio = chars / tokens
+        if not self.bounds[0] <= ratio <= self.bounds[1]:
+            return
+        with self._lock:
+            self.chars_per_token += self.smoothing * (ratio - self.chars_per_token)
+
+# Process-wide counter, shared by all sessions
+TOKEN_COUNTER = TokenCounter()
+
+class ContextBudget:
+    def __init__(self, num_ctx, answer_tokens=ANSWER_TOKENS_RESERVE, counter=TOKEN_COUNTER):
+        self.counter = counter
+        self.num_ctx = num_ctx
+        self.available = int(num_ctx * (1 - SAFETY_MARGIN)) - answer_tokens
+        self.used = 0
+        self.dropped = []  # Labels of content that did not fit
+        self.dropped_tokens = 0
+        self.saved_tokens = 0  # Tokens of repeated content that was sent only once
+
+    @property
+    def remaining(self):
+        return max(self.available - self.used, 0)
+
+    @property
+    def truncated(self):
+        return bool(self.dropped)
+
+    # Set aside room for a prompt part that is always sent (instructions, question)
+    def reserve(self, text):
+        self.available -= self.counter.count(text) + MESSAGE_OVERHEAD_TOKENS
+
+    # Add content if it fits; otherwise record it as dropped
+    def take(self, label, text=None, tokens=None):
+        tokens = tokens if tokens is not None else self.counter.count(text)
+        if tokens <= self.remaining:
+            self.used += tokens
+            return True
+        self.dropped.append(label)
+        self.dropped_tokens += tokens
+        return False
+
+    # Keep the leading part of text that fits and record the rest as dropped
+    def truncate(self, label, text):
+        tokens = self.counter.count(text)
+        if tokens <= self.remaining:
+            self.used += tokens
+            return text
+        keep_chars = self.counter.chars_for(self.remaining)
+        self.dropped.append(label)
+        self.dropped_tokens += tokens - self.remaining
+        self.used = self.available
+        return text[:keep_chars]
+
+    # One-line explanation of what was left out, for the UI
+    def describe(self):
+        if not self.dropped:
+            return ""
+        labels = list(dict.fromkeys(self.dropped))  # Several chunks can come from the same page
+        shown = ", ".join(labels[:5]) + (" …" if len(labels) > 5 else "")
+        return (
+            f"Context limit ({self.num_ctx} tokens): about {self.dropped_tokens} tokens did not fit "
+            f"and were left out ({shown})."
+        )
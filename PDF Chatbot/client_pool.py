@@ -0,0 +1,249 @@
+# Shared pool of Ollama clients with a fair request queue and load balancing across endpoints
+# The pool runs one asyncio event loop on a background thread with one keep-alive AsyncClient per endpoint.
+# Requests wait in a single queue ordered by priority and then by fair share between sessions (start-time fair
+# queuing: a session that submits many requests, like a long map-reduce summary, does not starve the others).
+# A queued request goes to the endpoint with the least outstanding work (estimated tokens) that is below its
+# concurrency cap. Callers use it synchronously through PooledClient, which mirrors ollama.Client.chat/generate.
+# This module is imported (not re-executed) by Streamlit, so the pool from get_client_pool() is shared by every session.
+import asyncio
+import heapq
+import itertools
+import os
+import queue
+import threading
+import time
+from functools import lru_cache
+import httpx
+import ollama
+from budget import TOKEN_COUNTER
+from metrics import METRICS
+#-------------------------------------------
+# Pool settings (can be overridden through environment variables)
+# Comma-separated Ollama base URLs; defaults to OLLAMA_HOST (or Ollama's default address)
+OLLAMA_ENDPOINTS = [
+    host.strip() for host in os.environ.get("PDF_CHATBOT_OLLAMA_ENDPOINTS", os.environ.get("OLLAMA_HOST", "")).split(",")
+    if host.strip()
+] or [None]
+ENDPOINT_CONCURRENCY = int(os.environ.get("PDF_CHATBOT_ENDPOINT_CONCURRENCY", 2))  # Generations in flight per endpoint
+REQUEST_TIMEOUT_SECONDS = float(os.environ.get("PDF_CHATBOT_REQUEST_TIMEOUT", 600))
+
+# Markers passed from the event loop to the waiting thread
+_DONE = object()
+
+class _Failure:
+    def __init__(self, error):
+        self.error = error
+
+class Endpoint:
+    def __init__(self, host, max_concurrency):
+        self.host = host or "default"
+        self.max_concurrency = max(max_concurrency, 1)
+        # Keep-alive connections are reused across requests; one spare connection per slot for warm-ups
+        limits = httpx.Limits(max_connections=self.max_concurrency + 1, max_keepalive_connections=self.max_concurrency + 1)
+        self.client = ollama.AsyncClient(host=host, limits=limits, timeout=REQUEST_TIMEOUT_SECONDS)
+        self.in_flight = 0
+        self.outstanding_tokens = 0  # Estimated prompt + answer tokens of the requests in flight
+        self.completed = 0
+
+class PoolRequest:
+    def __init__(self, method, kwargs, session_id, priority):
+        self.method = method
+        self.kwargs = kwargs
+        self.session_id = session_id
+        self.priority = priority
+        self.cost = estimate_cost(method, kwargs)
+        self.results = queue.Queue()  # Chunks (or the response) for the waiting thread, then _DONE
+        self.enqueued_at = time.time()
+        self.wait_seconds = None
+        self.endpoint = None
+        self.task = None
+        self.cancelled = False
+        self.finished = False
+
+# Estimated work of a request in tokens: prompt plus the answer limit
+def estimate_cost(method, kwargs):
+    if method == "chat":
+        prompt_tokens = TOKEN_COUNTER.count_messages(kwargs.get("messages") or [])
+    else:
+        prompt_tokens = TOKEN_COUNTER.count(kwargs.get("prompt") or "")
+    return prompt_tokens + (kwargs.get("options") or {}).get("num_predict", 0)
+
+class ClientPool:
+    def __init__(self, hosts=OLLAMA_ENDPOINTS, max_concurrency=ENDPOINT_CONCURRENCY):
+        self.endpoints = [Endpoint(host, max_concurrency) for host in hosts]
+        self._queue = []  # Heap of (priority, start tag, sequence, PoolRequest); only touched on the loop thread
+        self._session_tags = {}  # Session id -> start tag of its next request
+        self._virtual_time = 0  # Start tag of the last dispatched request
+        self._sequence = itertools.count()
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name="ollama-pool", daemon=True)
+        self._thread.start()
+
+    # Client bound to one session; lower priority values are served first
+    def session(self, session_id, priority=0):
+        return PooledClient(self, session_id, priority)
+
+    # Queue a request and wait for it: an iterator over chunks for stream=True, else the response
+    def call(self, method, session_id, priority=0, **kwargs):
+        request = PoolRequest(method, kwargs, session_id, priority)
+        self._loop.call_soon_threadsafe(self._enqueue, request)
+        if kwargs.get("stream"):
+            return request, self._iter_results(request)
+        return request, list(self._iter_results(request))[0]
+
+    # Send the same request to every endpoint at once, bypassing the queue (used to load the model everywhere)
+    def broadcast(self, method, **kwargs):
+        async def send_all():
+            return await asyncio.gather(
+                *(getattr(endpoint.client, method)(**kwargs) for endpoint in self.endpoints), return_exceptions=True
+            )
+        return asyncio.run_coroutine_threadsafe(send_all(), self._loop).result()
+
+    # Requests the endpoints can serve at once
+    @property
+    def capacity(self):
+        return sum(endpoint.max_concurrency for endpoint in self.endpoints)
+
+    # Queue depth and per-endpoint load, for display
+    def stats(self):
+        return {
+            "queue_depth": len(self._queue),
+            "endpoints": [
+                {
+                    "endpoint": endpoint.host,
+                    "in_flight": endpoint.in_flight,
+                    "max_concurrency": endpoint.max_concurrency,
+                    "outstanding_tokens": endpoint.outstanding_tokens,
+                    "completed": endpoint.completed,
+                }
+                for endpoint in self.endpoints
+            ],
+        }
+
+    # Everything below runs on the event loop thread
+    def _enqueue(self, request):
+        # Start-time fair queuing: a session's requests are spaced one tag apart, starting no earlier than now
+        start_tag = max(self._session_tags.get(request.session_id, 0), self._virtual_time)
+        self._session_tags[request.session_id] = start_tag + 1
+        heapq.heappush(self._queue, (request.priority, start_tag, next(self._sequence), request))
+        METRICS.observe("pool_queue_depth", len(self._queue))
+        self._dispatch()
+
+    # Start queued requests while some endpoint has a free slot
+    def _dispatch(self):
+        while self._queue:
+            free = [endpoint for endpoint in self.endpoints if endpoint.in_flight < endpoint.max_concurrency]
+            if not free:
+                return
+            _, start_tag, _, request = heapq.heappop(self._queue)
+            if request.cancelled:
+                continue
+            self._virtual_time = max(self._virtual_time, start_tag)
+            # Least outstanding work first; ties go to the endpoint with fewer requests in flight
+            endpoint = min(free, key=lambda endpoint: (endpoint.outstanding_tokens, endpoint.in_flight))
+            endpoint.in_flight += 1
+            endpoint.outstanding_tokens += request.cost
+            request.endpoint = endpoint.host
+            request.wait_seconds = time.time() - request.enqueued_at
+            METRICS.observe("pool_queue_wait_seconds", request.wait_seconds, endpoint=endpoint.host)
+            request.task = self._loop.create_task(self._run(endpoint, request))
+        # Forget sessions that have no queued requests left
+        if len(self._session_tags) > 1000:
+            self._session_tags = {
+                session_id: tag for session_id, tag in self._session_tags.items() if tag > self._virtual_time
+            }
+
+    async def _run(self, endpoint, request):
+        try:
+            response = await getattr(endpoint.client, request.method)(**request.kwargs)
+            if request.kwargs.get("stream"):
+                async for chunk in response:
+                    request.results.put(chunk)
+            else:
+                request.results.put(response)
+            request.results.put(_DONE)
+        except asyncio.CancelledError:
+            pass  # The caller stopped reading
+        except Exception as e:
+            request.results.put(_Failure(e))
+        finally:
+            endpoint.in_flight -= 1
+            endpoint.outstanding_tokens -= request.cost
+            endpoint.completed += 1
+            self._dispatch()
+
+    def _cancel(self, request):
+        request.cancelled = True
+        if request.task is not None:
+            request.task.cancel()
+
+    # Generator over a request's results on the calling thread; closing it early cancels the request
+    def _iter_results(self, request):
+        try:
+            while True:
+                item = request.results.get()
+                if item is _DONE:
+                    request.finished = True
+                    return
+                if isinstance(item, _Failure):
+                    request.finished = True
+                    raise item.error
+                yield item
+        finally:
+            if not request.finished:
+                self._loop.call_soon_threadsafe(self._cancel, request)
+
+# Drop-in for ollama.Client in the core functions, routed through the pool
+class PooledClient:
+    def __init__(self, pool, session_id, priority=0):
+        self.pool = pool
+        self.session_id = session_id
+        self.priority = priority
+        self.last_request = None  # PoolRequest of the latest call: endpoint and queue wait
+
+    def _call(self, method, kwargs):
+        self.last_request, result = self.pool.call(method, self.session_id, self.priority, **kwargs)
+        return result
+
+    def chat(self, **kwargs):
+        return self._call("chat", kwargs)
+
+    def generate(self, **kwargs):
+        return self._call("generate", kwargs)
+
+# Wrapper that lets at most limit requests through a client at once, across the threads sharing it
+# (e.g. all summaries of one batch); a streamed request holds its slot until the stream has been read
+class BoundedClient:
+    def __init__(self, client, limit):
+        self.client = client
+        self.limit = max(limit, 1)
+        self._slots = threading.BoundedSemaphore(self.limit)
+
+    def _call(self, method, kwargs):
+        self._slots.acquire()
+        try:
+            result = getattr(self.client, method)(**kwargs)
+        except BaseException:
+            self._slots.release()
+            raise
+        if kwargs.get("stream"):
+            return self._release_after(result)
+        self._slots.release()
+        return result
+
+    def _release_after(self, stream):
+        try:
+            yield from stream
+        finally:
+            self._slots.release()
+
+    def chat(self, **kwargs):
+        return self._call("chat", kwargs)
+
+    def generate(self, **kwargs):
+        return self._call("generate", kwargs)
+
+# One pool per process
+@lru_cache(maxsize=None)
+def get_client_pool():
+    return ClientPool()
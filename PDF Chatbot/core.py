@@ -0,0 +1,955 @@
+# Headless core of the PDF chatbot: extraction, retrieval, prompting, summarization and answer streaming
+# Nothing here touches Streamlit. Progress, warnings and tokens are reported to a StreamCollector that the
+# caller passes in (the web app subclasses it to draw bubbles; batch_qa.py uses it as is), errors are raised,
+# and every model call goes through an Ollama client (the ollama module itself, an ollama.Client or a PooledClient).
+# This module is imported (not re-executed) by Streamlit, so the caches below are shared by every session.
+import fitz  # PyMuPDF
+import ollama
+import csv
+import re
+import threading
+import time
+import weakref
+import hashlib
+import json
+import math
+import os
+import zlib
+from collections import Counter, OrderedDict, defaultdict
+from itertools import zip_longest
+from array import array
+from bisect import bisect_left
+from io import StringIO
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from functools import lru_cache
+from extraction import EXTRACT_TABLES, iter_extract_pages  # Page-sharded process-pool extraction engine
+from metrics import METRICS  # Process-wide latency/token histograms with Prometheus and JSONL export
+from docstore import DOCUMENT_STORE  # Process-wide memory-mapped store of extracted text
+from budget import ANSWER_TOKENS_RESERVE, TOKEN_COUNTER, ContextBudget  # Token counting and context packing
+from dedup import DEDUP_THRESHOLD, DuplicateGroups, band_keys, minhash_signature  # MinHash/LSH near-duplicate grouping
+#-------------------------------------------
+# Retrieval settings (can be overridden through environment variables)
+CHUNK_SIZE_WORDS = int(os.environ.get("PDF_CHATBOT_CHUNK_WORDS", 180))  # Words per retrieval chunk
+CHUNK_OVERLAP_WORDS = int(os.environ.get("PDF_CHATBOT_CHUNK_OVERLAP", 40))  # Words shared by neighbouring chunks
+RETRIEVAL_TOP_K = int(os.environ.get("PDF_CHATBOT_TOP_K", 8))  # Max chunks sent with a question
+CONTEXT_TOKEN_BUDGET = int(os.environ.get("PDF_CHATBOT_CONTEXT_TOKENS", 1500))  # Token budget for retrieved chunks
+EMBEDDING_MODEL = os.environ.get("PDF_CHATBOT_EMBED_MODEL", "")  # e.g. "nomic-embed-text"; empty disables embeddings
+# Extraction cache settings
+CACHE_DIR = os.environ.get("PDF_CHATBOT_CACHE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache"))
+EXTRACT_CACHE_MAX_BYTES = int(os.environ.get("PDF_CHATBOT_EXTRACT_CACHE_MB", 512)) * 1024 * 1024
+# Bump the suffix whenever extraction output changes; pages extracted without tables are cached under their own key
+EXTRACTOR_VERSION = f"pymupdf-{fitz.VersionBind}-text-tables-3" + ("" if EXTRACT_TABLES else "-no-tables")
+# Response cache settings
+RESPONSE_CACHE_MAX_BYTES = int(os.environ.get("PDF_CHATBOT_RESPONSE_CACHE_MB", 64)) * 1024 * 1024
+RESPONSE_CACHE_TTL_SECONDS = int(os.environ.get("PDF_CHATBOT_RESPONSE_CACHE_TTL", 7 * 24 * 3600))
+# Model and summarization settings
+LLM_MODEL = os.environ.get("PDF_CHATBOT_MODEL", "llama3.2:1b")
+# Ollama runtime options; the model is warmed up at startup and kept loaded between requests
+OLLAMA_KEEP_ALIVE = os.environ.get("PDF_CHATBOT_KEEP_ALIVE", "30m")
+OLLAMA_NUM_CTX = int(os.environ.get("PDF_CHATBOT_NUM_CTX", 8192))
+OLLAMA_NUM_THREAD = int(os.environ.get("PDF_CHATBOT_NUM_THREAD", 0))  # 0 lets Ollama decide
+OLLAMA_OPTIONS = {"num_ctx": OLLAMA_NUM_CTX, "num_predict": ANSWER_TOKENS_RESERVE}  # Answers stay inside the reserved room
+if OLLAMA_NUM_THREAD:
+    OLLAMA_OPTIONS["num_thread"] = OLLAMA_NUM_THREAD
+DEDUP_MAX_SOURCES = 5  # Sources listed in the label of a passage shared by several documents or pages
+STABLE_CONTEXT_TOKENS = int(os.environ.get("PDF_CHATBOT_STABLE_CONTEXT_TOKENS", 4096))  # Send every page if the corpus fits
+SUMMARY_SECTION_TOKENS = int(os.environ.get("PDF_CHATBOT_SUMMARY_SECTION_TOKENS", 2000))  # Tokens per map section
+SUMMARY_MAX_INFLIGHT = int(os.environ.get("PDF_CHATBOT_SUMMARY_INFLIGHT", 4))  # Concurrent section requests to Ollama
+SUMMARY_MAX_LEVELS = 4  # Stop reducing if the partial summaries refuse to shrink
+SUMMARY_CACHE_SIZE = 256  # Summaries kept in memory, shared by all sessions
+#-------------------------------------------
+# Zlib-compressed JSON entries on disk with LRU eviction by size and optional expiry by age
+# A file's mtime records when it was written and its atime when it was last read
+class DiskCache:
+    def __init__(self, directory, max_bytes, ttl_seconds=None):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        os.makedirs(self.directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}.bin")
+
+    # Return the cached value, or None on a miss or an expired entry
+    def get(self, key):
+        path = self._path(key)
+        try:
+            written_at = os.stat(path).st_mtime
+            if self.ttl_seconds is not None and time.time() - written_at > self.ttl_seconds:
+                os.remove(path)
+                return None
+            with open(path, "rb") as f:
+                value = json.loads(zlib.decompress(f.read()))
+            os.utime(path, (time.time(), written_at))  # Mark as recently used for LRU eviction
+            return value
+        except (OSError, ValueError, zlib.error):
+            return None
+
+    # Store a JSON-serializable value, then enforce the size limit
+    def put(self, key, value):
+        path = self._path(key)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, "wb") as f:
+                f.write(zlib.compress(json.dumps(value).encode("utf-8"), 6))
+            os.replace(tmp_path, path)  # Atomic so concurrent sessions never read half a file
+        except OSError:
+            return
+        self.evict()
+
+    # Delete expired entries, then least recently used ones until the cache fits in max_bytes
+    def evict(self):
+        entries = []
+        now = time.time()
+        for entry in os.scandir(self.directory):
+            if not entry.name.endswith(".bin"):
+                continue
+            try:
+                stat = entry.stat()
+                if self.ttl_seconds is not None and now - stat.st_mtime > self.ttl_seconds:
+                    os.remove(entry.path)
+                    continue
+            except OSError:
+                continue
+            entries.append((stat.st_atime, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
+
+    # Remove every entry
+    def clear(self):
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(".bin"):
+                try:
+                    os.remove(entry.path)
+                except OSError:
+                    pass
+
+# Content-addressed on-disk cache of extracted pages, shared by all sessions
+class ExtractionCache(DiskCache):
+    def __init__(self, directory=os.path.join(CACHE_DIR, "extract"), max_bytes=EXTRACT_CACHE_MAX_BYTES):
+        super().__init__(directory, max_bytes)
+
+    # Cache key for a document: its content hash combined with the extractor version
+    def key(self, content_hash):
+        return hashlib.sha256(f"{EXTRACTOR_VERSION}:{content_hash}".encode()).hexdigest()
+
+# On-disk cache of model answers, shared by all sessions and expired after a TTL
+class ResponseCache(DiskCache):
+    def __init__(self, directory=os.path.join(CACHE_DIR, "responses"), max_bytes=RESPONSE_CACHE_MAX_BYTES,
+                 ttl_seconds=RESPONSE_CACHE_TTL_SECONDS):
+        super().__init__(directory, max_bytes, ttl_seconds)
+
+    # Cache key: model, system prompt, normalized question and the fingerprint of the loaded documents
+    def key(self, model, system_prompt, question, doc_fingerprint):
+        payload = json.dumps([model, system_prompt, normalize_question(question), doc_fingerprint])
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+# Lowercase, collapse whitespace and drop trailing punctuation so trivially different questions share an entry
+def normalize_question(question):
+    return " ".join(question.lower().split()).rstrip(" ?!.")
+
+# Fingerprint of a set of documents; changes whenever a document is added or removed
+def document_fingerprint(content_hashes):
+    return hashlib.sha256("\n".join(sorted(content_hashes)).encode()).hexdigest()
+
+# One response cache per process
+@lru_cache(maxsize=None)
+def get_response_cache():
+    return ResponseCache()
+
+# One extraction cache per process
+@lru_cache(maxsize=None)
+def get_extraction_cache():
+    return ExtractionCache()
+
+# SHA-256 of the raw PDF bytes, used to identify a document regardless of its file name
+def hash_pdf_bytes(pdf_bytes):
+    return hashlib.sha256(pdf_bytes).hexdigest()
+
+#-------------------------------------------
+# Generator over the (page_num, page_text, page_tables) of one PDF, served from the extraction cache when possible
+def iter_pdf_pages(pdf_bytes, content_hash):
+    cache = get_extraction_cache()
+    cache_key = cache.key(content_hash)
+    # A repeat upload only costs a hash and a cache read
+    cached = cache.get(cache_key)
+    if cached is not None:
+        METRICS.inc("extract_cache", result="hit")
+        for page_num, (page_text, page_tables) in enumerate(zip(cached["pages"], cached["tables"]), start=1):
+            yield page_num, page_text, page_tables
+        return
+    METRICS.inc("extract_cache", result="miss")
+    pages = []
+    tables = []  # Tables of each page, cached with the text
+    page_start = time.perf_counter()
+    for page_index, page_text, page_tables in iter_extract_pages(pdf_bytes):
+        # Only the time spent producing the page, not the consumer's time between pages
+        METRICS.observe("extract_page_seconds", time.perf_counter() - page_start)
+        pages.append(page_text)
+        tables.append(page_tables)
+        yield page_index + 1, page_text, page_tables
+        page_start = time.perf_counter()
+    cache.put(cache_key, {"pages": pages, "tables": tables})
+
+# Content hash, page texts and tables of one PDF
+def extract_document(pdf_bytes):
+    content_hash = hash_pdf_bytes(pdf_bytes)
+    pages = []
+    tables = []
+    with METRICS.span("extract_file"):
+        for _, page_text, page_tables in iter_pdf_pages(pdf_bytes, content_hash):
+            pages.append(page_text)
+            tables.extend(page_tables)
+    return content_hash, pages, tables
+
+# PART-1A :#
+#-------------------------------------------
+# Retrieval index: overlapping page-aware chunks with BM25 (plus optional embeddings)
+TOKEN_PATTERN = re.compile(r"\w+")
+
+# Split text into lowercase word tokens
+def tokenize(text):
+    return TOKEN_PATTERN.findall(text.lower())
+
+# Token estimate from the calibrated process-wide counter
+def estimate_tokens(text):
+    return TOKEN_COUNTER.count(text)
+
+WORD_PATTERN = re.compile(r"\S+")
+
+# Split (page_num, page_text) pairs into overlapping word windows that remember their page number
+# Chunks are (page_num, start, end) character offsets into the page instead of copies of its text
+def chunk_pages(numbered_pages, chunk_size=CHUNK_SIZE_WORDS, overlap=CHUNK_OVERLAP_WORDS):
+    step = max(chunk_size - overlap, 1)
+    chunks = []
+    for page_num, page_text in numbered_pages:
+        spans = [match.span() for match in WORD_PATTERN.finditer(page_text)]
+        for start in range(0, max(len(spans) - overlap, 1), step):
+            window = spans[start:start + chunk_size]
+            if window:
+                chunks.append((page_num, window[0][0], window[-1][1]))
+    return chunks
+
+#-------------------------------------------
+# Tables found at extraction time (dicts with page, bbox, header and rows; see extraction.extract_page_tables)
+TABLE_TOP_K = int(os.environ.get("PDF_CHATBOT_TABLE_TOP_K", 2))  # Max extracted tables sent with a question
+TABLE_PROMPT_MAX_ROWS = 60  # Rows of a table sent to the model
+NUMBER_PATTERN = re.compile(r"^\(?-?[$€£]?\s*[\d.,]+\s*%?\)?$")
+NUMBER_NOISE = re.compile(r"[$€£%,\s()]")
+
+# Column names for a table: blank or repeated header cells get positional names
+def table_columns(table):
+    width = max([len(table["header"])] + [len(row) for row in table["rows"]])
+    columns = []
+    for i in range(width):
+        name = table["header"][i] if i < len(table["header"]) and table["header"][i] else f"Column {i + 1}"
+        while name in columns:
+            name += f" ({i + 1})"
+        columns.append(name)
+    return columns
+
+# Parse a number cell ("1,234", "$5.50", "12%", "(300)" for -300); None if it is not a number
+def parse_number(cell):
+    if not NUMBER_PATTERN.match(cell):
+        return None
+    try:
+        value = float(NUMBER_NOISE.sub("", cell))
+    except ValueError:
+        return None
+    return -value if cell.startswith("(") else value
+
+# Typed DataFrame for a table: columns whose filled cells are (nearly) all numbers become numeric
+def table_frame(table):
+    import pandas as pd
+    columns = table_columns(table)
+    rows = [row + [""] * (len(columns) - len(row)) for row in table["rows"]]
+    frame = pd.DataFrame(rows, columns=columns)
+    for column in columns:
+        filled = [cell for cell in frame[column] if cell]
+        numbers = [parse_number(cell) for cell in filled]
+        if filled and sum(number is not None for number in numbers) >= 0.8 * len(filled):
+            values = pd.to_numeric(pd.Series([parse_number(cell) if cell else None for cell in frame[column]]), errors="coerce")
+            # Whole numbers stay integers (nullable, so blank cells survive)
+            if values.dropna().apply(float.is_integer).all():
+                values = values.astype("Int64")
+            frame[column] = values
+    frame.attrs["page"] = table["page"]
+    return frame
+
+# Typed frames for a document's tables, built once per document
+_table_frames = weakref.WeakKeyDictionary()
+
+def table_frames(document):
+    frames = _table_frames.get(document)
+    if frames is None:
+        frames = _table_frames[document] = [table_frame(table) for table in document.tables]
+    return frames
+
+# CSV text of a table (the exact cells, at most max_rows body rows)
+def table_csv(table, max_rows=None):
+    buffer = StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(table_columns(table))
+    writer.writerows(table["rows"][:max_rows])
+    return buffer.getvalue()
+
+# Embed texts with a local Ollama embedding model; None if the model is unavailable
+def embed_texts(model, texts):
+    try:
+        import numpy as np
+        vectors = np.asarray(ollama.embed(model=model, input=texts)["embeddings"], dtype="float32")
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return list(vectors / np.maximum(norms, 1e-9))
+    except Exception:
+        return None
+
+# Retrieval data of one stored document: chunks, BM25 term statistics, MinHash signatures with their LSH buckets,
+# embeddings and table terms. It depends only on the document's content, so it is kept on the document and built
+# once, by the first session that needs each page; every session holding the document searches the same copy.
+# Pages are only ever appended, and readers only look at the pages they have linked (see RetrievalIndex).
+class DocumentIndex:
+    def __init__(self, embedding_model=EMBEDDING_MODEL):
+        self.embedding_model = embedding_model
+        self.page_tokens = array("I")  # Estimated tokens of each page
+        self.page_signatures = [None]  # MinHash signature by page number (None for pages without words)
+        self.page_buckets = defaultdict(list)  # LSH band key -> page numbers
+        self.page_chunk_ends = array("I", [0])  # Chunks of page p have ids page_chunk_ends[p - 1]..page_chunk_ends[p] - 1
+        self.chunk_pages = array("I")  # Page of each chunk
+        self.chunk_starts = array("I")  # Character offsets of each chunk within its page
+        self.chunk_ends = array("I")
+        self.chunk_tokens = array("I")  # Tokens of each chunk up to where the next one on its page starts
+        self.term_freqs = []  # Counter of terms for each chunk
+        self.length_sums = array("Q", [0])  # Terms in chunks 0..i-1, so BM25 can average over any prefix of chunks
+        self.postings = defaultdict(list)  # Term -> ids of chunks containing it, ascending
+        self.signatures = []  # MinHash signature of each chunk (None for chunks without words)
+        self.buckets = defaultdict(list)  # LSH band key -> chunk ids
+        self.embeddings = []  # Optional embedding vector per chunk
+        self.table_terms = []  # Set of terms in the header and cells of each of the document's tables
+        self._lock = threading.Lock()
+
+    # Pages indexed so far (a page counts once all of its chunks are in)
+    @property
+    def page_count(self):
+        return len(self.page_chunk_ends) - 1
+
+    # Index the document's pages up to page_count, and the tables found so far, unless that was already done
+    def ensure_pages(self, document, page_count):
+        if self.page_count >= page_count and len(self.table_terms) >= len(document.tables):
+            return
+        with self._lock:
+            first_chunk = len(self.chunk_pages)
+            page_texts = {}
+            for page_num in range(self.page_count + 1, page_count + 1):
+                page_texts[page_num] = document.page_text(page_num)
+                self._add_page(page_num, page_texts[page_num])
+            if self.embedding_model and len(self.chunk_pages) > first_chunk:
+                vectors = embed_texts(self.embedding_model, [
+                    page_texts[self.chunk_pages[chunk_id]][self.chunk_starts[chunk_id]:self.chunk_ends[chunk_id]]
+                    for chunk_id in range(first_chunk, len(self.chunk_pages))
+                ])
+                if vectors is None:
+                    self.embedding_model = ""  # Unavailable: BM25 only from now on
+                    self.embeddings = []
+                else:
+                    self.embeddings.extend(vectors)
+            for table in document.tables[len(self.table_terms):]:
+                self.table_terms.append(set(tokenize(" ".join(table["header"] + [cell for row in table["rows"] for cell in row]))))
+
+    def _add_page(self, page_num, page_text):
+        self.page_tokens.append(estimate_tokens(page_text))
+        signature = minhash_signature(page_text) if DEDUP_THRESHOLD > 0 else None
+        self.page_signatures.append(signature)
+        if signature is not None:
+            for band in band_keys(signature):
+                self.page_buckets[band].append(page_num)
+        new_chunks = chunk_pages([(page_num, page_text)])
+        for position, (_, start, end) in enumerate(new_chunks):
+            chunk_id = len(self.chunk_pages)
+            text = page_text[start:end]
+            self.chunk_pages.append(page_num)
+            self.chunk_starts.append(start)
+            self.chunk_ends.append(end)
+            # Count each chunk up to where the next one starts, so the overlap is counted once
+            own_end = new_chunks[position + 1][1] if position + 1 < len(new_chunks) else end
+            self.chunk_tokens.append(estimate_tokens(text[:own_end - start]))
+            signature = minhash_signature(text) if DEDUP_THRESHOLD > 0 else None
+            self.signatures.append(signature)
+            if signature is not None:
+                for band in band_keys(signature):
+                    self.buckets[band].append(chunk_id)
+            terms = Counter(tokenize(text))
+            self.term_freqs.append(terms)
+            self.length_sums.append(self.length_sums[-1] + sum(terms.values()))
+            for term in terms:
+                self.postings[term].append(chunk_id)
+        self.page_chunk_ends.append(len(self.chunk_pages))
+
+# Retrieval index of a stored document, created on first use and shared by everyone holding the document
+def document_index(document, embedding_model=EMBEDDING_MODEL):
+    key = ("retrieval", embedding_model)
+    index = document.indexes.get(key)
+    if index is None:
+        index = document.indexes.setdefault(key, DocumentIndex(embedding_model))
+    return index
+
+# One session's corpus: the documents it loaded, how many pages of each it has linked, and the near-duplicate
+# groups and token totals across them. The chunks and term statistics themselves are the documents' shared
+# DocumentIndex objects, so sessions over the same uploads add little beyond their duplicate groups.
+# Chunks are identified by (doc_name, chunk id within the document).
+class RetrievalIndex:
+    def __init__(self, embedding_model=EMBEDDING_MODEL, k1=1.5, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self.embedding_model = embedding_model
+        self.documents = {}  # Document name -> StoredDocument holding its text
+        self.linked_pages = {}  # Document name -> pages of it that are searchable (the first n)
+        self.pages = []  # (doc_name, page_num) in ingestion order, kept while the corpus fits the stable context
+        self.page_tokens = 0  # Tokens of the distinct pages (near-duplicates of an earlier page are not counted)
+        self.duplicate_page_tokens = 0
+        # Near-identical pages and chunks (e.g. several revisions of one report) are grouped and sent once
+        self.page_duplicates = DuplicateGroups()  # Keys are (doc_name, page_num)
+        self.chunk_duplicates = DuplicateGroups()  # Keys are (doc_name, chunk id)
+        self.text_tokens = 0  # Tokens of indexed text, without the overlap between neighbouring chunks
+        self.duplicate_tokens = 0  # Part of text_tokens that repeats an earlier passage
+        self._full_context = None  # Cached full-corpus context, rebuilt only when pages are added
+
+    def __len__(self):
+        return sum(chunk_count for _, _, chunk_count in self._linked())
+
+    # Shared index of one of the documents
+    def _index(self, doc_name):
+        return document_index(self.documents[doc_name], self.embedding_model)
+
+    # (doc_name, DocumentIndex, searchable chunk count) for every document, in the order they were added
+    def _linked(self):
+        linked = []
+        for doc_name in self.documents:
+            index = self._index(doc_name)
+            linked.append((doc_name, index, index.page_chunk_ends[self.linked_pages.get(doc_name, 0)]))
+        return linked
+
+    # Index a newly extracted document (its text is kept in a private store document)
+    def add_document(self, doc_name, pages, tables=()):
+        self.set_document(doc_name, DOCUMENT_STORE.from_pages(pages, tables))
+        self.index_pages(doc_name, len(pages))
+
+    # Document that holds the text (and, once extraction is complete, the tables) of doc_name's pages
+    # A shared copy can replace a private one with the same content; its index is completed up to the linked pages
+    def set_document(self, doc_name, document):
+        self.documents[doc_name] = document
+        if self.linked_pages.get(doc_name):
+            self._index(doc_name).ensure_pages(document, self.linked_pages[doc_name])
+
+    # Make doc_name's pages up to page_count searchable, indexing any that no session has indexed yet
+    def index_pages(self, doc_name, page_count):
+        document = self.documents[doc_name]
+        index = self._index(doc_name)
+        index.ensure_pages(document, page_count)
+        first_page = self.linked_pages.get(doc_name, 0) + 1
+        if page_count < first_page:
+            return
+        # A page that repeats an earlier one is sent under that page's label instead of on its own
+        others = [(name, self._index(name).page_signatures, self._index(name).page_buckets, pages + 1)
+                  for name, pages in self.linked_pages.items() if name != doc_name]
+        for page_num in range(first_page, page_count + 1):
+            key = (doc_name, page_num)
+            sources = others + [(doc_name, index.page_signatures, index.page_buckets, page_num)]
+            if self.page_duplicates.add(key, index.page_signatures[page_num], sources) != key:
+                self.duplicate_page_tokens += index.page_tokens[page_num - 1]
+                continue
+            self.page_tokens += index.page_tokens[page_num - 1]
+            if self.pages is not None:
+                self.pages.append(key)
+        if self.page_tokens > STABLE_CONTEXT_TOKENS:
+            self.pages = None  # The corpus will never fit the stable context again
+        self._full_context = None
+        others = [(name, other.signatures, other.buckets, chunk_count)
+                  for name, other, chunk_count in self._linked() if name != doc_name]
+        for chunk_id in range(index.page_chunk_ends[first_page - 1], index.page_chunk_ends[page_count]):
+            key = (doc_name, chunk_id)
+            sources = others + [(doc_name, index.signatures, index.buckets, chunk_id)]
+            self.text_tokens += index.chunk_tokens[chunk_id]
+            if self.chunk_duplicates.add(key, index.signatures[chunk_id], sources) != key:
+                self.duplicate_tokens += index.chunk_tokens[chunk_id]
+        self.linked_pages[doc_name] = page_count
+
+    # Drop a document (e.g. one whose extraction failed) from the session
+    # Duplicate groups may point at it, so the remaining documents are linked again, in order, from their shared indexes
+    def remove_document(self, doc_name):
+        self.documents.pop(doc_name, None)
+        linked_pages = self.linked_pages
+        self.linked_pages = {}
+        self.pages = []
+        self.page_tokens = self.duplicate_page_tokens = 0
+        self.page_duplicates = DuplicateGroups()
+        self.chunk_duplicates = DuplicateGroups()
+        self.text_tokens = self.duplicate_tokens = 0
+        self._full_context = None
+        for name in self.documents:
+            if linked_pages.get(name):
+                self.index_pages(name, linked_pages[name])
+
+    # Extracted tables that match a question, best first, as (doc_name, table) pairs
+    # A table needs at least two of the question's terms (or its only term); rarer terms weigh more
+    def search_tables(self, question, top_k=TABLE_TOP_K):
+        query_terms = set(tokenize(question))
+        tables = []  # (doc_name, table position, terms) of the tables on searchable pages
+        for doc_name, document in self.documents.items():
+            linked = self.linked_pages.get(doc_name, 0)
+            for position, terms in enumerate(self._index(doc_name).table_terms):
+                if document.tables[position]["page"] <= linked:
+                    tables.append((doc_name, position, terms))
+        doc_freqs = Counter(term for _, _, terms in tables for term in query_terms & terms)
+        scored = []
+        for doc_name, position, terms in tables:
+            matched = query_terms & terms
+            if len(matched) < min(2, len(query_terms)) or not matched:
+                continue
+            score = sum(math.log(1 + len(tables) / doc_freqs[term]) for term in matched)
+            scored.append((score, doc_name, position))
+        scored.sort(key=lambda item: -item[0])
+        return [(doc_name, self.documents[doc_name].tables[position]) for _, doc_name, position in scored[:top_k]]
+
+    # Page of a chunk
+    def chunk_page(self, key):
+        return self._index(key[0]).chunk_pages[key[1]]
+
+    # Text of a chunk, sliced from its page in the document store
+    def chunk_text(self, key):
+        index = self._index(key[0])
+        page_text = self.documents[key[0]].page_text(index.chunk_pages[key[1]])
+        return page_text[index.chunk_starts[key[1]]:index.chunk_ends[key[1]]]
+
+    # Label for a passage found on one or more (doc_name, page_num) sources
+    def source_label(self, sources):
+        sources = list(dict.fromkeys(sources))
+        label = "; ".join(f"{doc_name}, page {page_num}" for doc_name, page_num in sources[:DEDUP_MAX_SOURCES])
+        if len(sources) > DEDUP_MAX_SOURCES:
+            label += f"; {len(sources) - DEDUP_MAX_SOURCES} more"
+        return f"[{label}]"
+
+    # Indexed tokens and how many of them repeat an earlier passage, for display
+    def duplicate_stats(self):
+        return {
+            "tokens": self.text_tokens,
+            "duplicate_tokens": self.duplicate_tokens,
+            "duplicate_share": self.duplicate_tokens / self.text_tokens if self.text_tokens else 0.0,
+            "groups": self.chunk_duplicates.duplicate_groups(),
+        }
+
+    # Okapi BM25 scores for every searchable chunk that shares a term with the query
+    def _bm25_scores(self, query_terms, linked):
+        scores = defaultdict(float)
+        chunk_count = sum(count for _, _, count in linked)
+        total_length = sum(index.length_sums[count] for _, index, count in linked)
+        avg_length = total_length / chunk_count if chunk_count else 0
+        for term in set(query_terms):
+            # Postings are ascending, so the searchable ones are a prefix
+            matches = []
+            for doc_name, index, count in linked:
+                chunk_ids = index.postings.get(term, ())
+                matches.append((doc_name, index, chunk_ids[:bisect_left(chunk_ids, count)]))
+            doc_freq = sum(len(chunk_ids) for _, _, chunk_ids in matches)
+            if not doc_freq:
+                continue
+            idf = math.log(1 + (chunk_count - doc_freq + 0.5) / (doc_freq + 0.5))
+            for doc_name, index, chunk_ids in matches:
+                for chunk_id in chunk_ids:
+                    tf = index.term_freqs[chunk_id][term]
+                    length = index.length_sums[chunk_id + 1] - index.length_sums[chunk_id]
+                    norm = self.k1 * (1 - self.b + self.b * length / (avg_length or 1))
+                    scores[(doc_name, chunk_id)] += idf * tf * (self.k1 + 1) / (tf + norm)
+        return scores
+
+    # Return the keys of the best chunks for a question, best first
+    def search(self, question, top_k=RETRIEVAL_TOP_K):
+        linked = self._linked()
+        if not any(count for _, _, count in linked):
+            return []
+        bm25 = self._bm25_scores(tokenize(question), linked)
+        ranked = sorted(bm25, key=bm25.get, reverse=True)
+        if self.embedding_model and all(
+            index.embedding_model == self.embedding_model and len(index.embeddings) >= count for _, index, count in linked
+        ):
+            query_vector = embed_texts(self.embedding_model, [question])
+            if query_vector is None:
+                self.embedding_model = ""
+            else:
+                import numpy as np
+                keys = [(doc_name, chunk_id) for doc_name, _, count in linked for chunk_id in range(count)]
+                vectors = [index.embeddings[chunk_id] for _, index, count in linked for chunk_id in range(count)]
+                similarities = np.stack(vectors) @ query_vector[0]
+                dense = [keys[i] for i in np.argsort(-similarities)[: top_k * 4]]
+                # Reciprocal rank fusion of the lexical and embedding rankings
+                fused = defaultdict(float)
+                for rank, key in enumerate(ranked[: top_k * 4]):
+                    fused[key] += 1 / (60 + rank)
+                for rank, key in enumerate(dense):
+                    fused[key] += 1 / (60 + rank)
+                ranked = sorted(fused, key=fused.get, reverse=True)
+        if not ranked:
+            # No lexical overlap: fall back to the opening chunks of each document, taking documents in turn
+            doc_chunks = [[(doc_name, chunk_id) for chunk_id in range(count)] for doc_name, _, count in linked]
+            ranked = [key for row in zip_longest(*doc_chunks) for key in row if key is not None]
+        # Near-duplicate chunks rank alike; keep one per group (its first chunk) so they do not crowd out other passages
+        ranked = list(dict.fromkeys(self.chunk_duplicates.representative(key) for key in ranked))
+        return ranked[:top_k]
+
+    # Build the context for a question from the top chunks that fit in the token budget
+    # budget is a ContextBudget for the model's window; relevant chunks that do not fit are recorded in it, and so are
+    # the tokens saved by sending a passage repeated across documents once, labelled with all of its sources
+    def build_context(self, question, budget=None, top_k=RETRIEVAL_TOP_K, token_budget=CONTEXT_TOKEN_BUDGET,
+                      stable_tokens=STABLE_CONTEXT_TOKENS):
+        budget = budget or ContextBudget(OLLAMA_NUM_CTX)
+        # Small corpora are sent whole, as a byte-identical prefix Ollama can reuse between questions
+        if self.pages is not None and self.page_tokens <= min(stable_tokens, budget.remaining):
+            if self._full_context is None:
+                self._full_context = "\n\n".join(
+                    f"{self.source_label(self.page_duplicates.group((doc_name, page_num)))}\n"
+                    f"{self.documents[doc_name].page_text(page_num).strip()}"
+                    for doc_name, page_num in self.pages
+                )
+            # The page labels add tokens of their own; if the labelled pages do not fit, retrieval picks passages instead
+            if budget.counter.count(self._full_context) <= budget.remaining:
+                budget.take("all pages", self._full_context)
+                budget.saved_tokens += self.duplicate_page_tokens
+                return self._full_context
+        selected = {}  # Chunk key -> source label
+        used_tokens = 0
+        for key in self.search(question, top_k):
+            doc_name, chunk_id = key
+            index = self._index(doc_name)
+            members = self.chunk_duplicates.group(key)
+            label = self.source_label((member[0], self.chunk_page(member)) for member in members)
+            text_tokens = int((index.chunk_ends[chunk_id] - index.chunk_starts[chunk_id]) / TOKEN_COUNTER.chars_per_token)
+            part_tokens = text_tokens + estimate_tokens(label)
+            # Retrieval keeps its own cap; only chunks that do not fit the model's window count as dropped
+            if used_tokens + part_tokens > token_budget:
+                continue
+            if not budget.take(f"{doc_name} p.{index.chunk_pages[chunk_id]}", tokens=part_tokens):
+                continue
+            selected[key] = label
+            used_tokens += part_tokens
+            budget.saved_tokens += text_tokens * (len(members) - 1)  # The other copies are not sent
+        # Document order (not score order) so related questions share the longest possible prefix
+        doc_order = {doc_name: position for position, doc_name in enumerate(self.documents)}
+        parts = [
+            f"{selected[key]}\n{self.chunk_text(key)}" for key in sorted(selected, key=lambda key: (doc_order[key[0]], key[1]))
+        ]
+        # Matching tables go in as exact CSV, so the model reasons over cells instead of flattened page text
+        for doc_name, table in self.search_tables(question):
+            part = f"[{doc_name}, page {table['page']}, table as CSV]\n{table_csv(table, TABLE_PROMPT_MAX_ROWS)}"
+            if budget.take(f"{doc_name} p.{table['page']} table", part):
+                parts.append(part)
+        return "\n\n".join(parts)
+
+# PART-2A :#
+#-------------------------------------------
+# Collects a streamed Ollama chat response with its timings and token counts
+# Front ends subclass it: feed() sees every token, notice() gets user-facing warnings and progress() reports map-reduce steps
+class StreamCollector:
+    def __init__(self, kind, start_time=None):
+        self.kind = kind  # Metrics label
+        self.final_chunk = None  # Ollama's last chunk: token counts and durations
+        self.start_time = start_time or time.time()
+        self.first_token_time = None
+        self.token_count = 0
+        self.parts = []
+        self.notices = []
+        self.context_saved_tokens = 0  # Prompt tokens saved by sending repeated passages once
+
+    # Time to first token in seconds (None until a token arrived)
+    @property
+    def ttft(self):
+        return self.first_token_time - self.start_time if self.first_token_time else None
+
+    # Decode speed: Ollama's own eval counters when available, else streamed chunks (≈ tokens) per second
+    @property
+    def tokens_per_second(self):
+        if self.final_chunk and self.final_chunk.get("eval_count") and self.final_chunk.get("eval_duration"):
+            return self.final_chunk["eval_count"] / (self.final_chunk["eval_duration"] / 1e9)
+        if not self.first_token_time or self.token_count < 2:
+            return 0.0
+        decode_time = time.time() - self.first_token_time
+        return (self.token_count - 1) / decode_time if decode_time > 0 else 0.0
+
+    @property
+    def text(self):
+        return "".join(self.parts)
+
+    def feed(self, content):
+        if not content:
+            return
+        if self.first_token_time is None:
+            self.first_token_time = time.time()
+        self.parts.append(content)
+        self.token_count += 1
+
+    # Something the user should know about the request (e.g. excerpts that did not fit the context)
+    def notice(self, message):
+        self.notices.append(message)
+
+    # Progress of a multi-step request; fraction None means the steps are over
+    def progress(self, fraction, text=None):
+        pass
+
+    # Consume an Ollama chat stream and return the full text and elapsed time
+    def stream(self, response):
+        for chunk in response:
+            if "message" in chunk:
+                self.feed(chunk["message"].get("content", ""))
+            if chunk.get("done"):
+                self.final_chunk = chunk
+        return self.finish()
+
+    def finish(self):
+        elapsed_time = time.time() - self.start_time
+        self.record_metrics(elapsed_time)
+        return self.text, elapsed_time
+
+    # Record latency and token metrics, using the counters from Ollama's final chunk when present
+    def record_metrics(self, elapsed_time):
+        METRICS.observe("response_seconds", elapsed_time, kind=self.kind)
+        METRICS.observe("ttft_seconds", self.ttft, kind=self.kind)
+        final = self.final_chunk
+        if not final:
+            return
+        METRICS.observe("prompt_tokens", final.get("prompt_eval_count"), kind=self.kind)
+        METRICS.observe("completion_tokens", final.get("eval_count"), kind=self.kind)
+        if final.get("load_duration"):
+            METRICS.observe("model_load_seconds", final["load_duration"] / 1e9, kind=self.kind)
+        if final.get("prompt_eval_count") and final.get("prompt_eval_duration"):
+            METRICS.observe("prefill_tokens_per_second", final["prompt_eval_count"] / (final["prompt_eval_duration"] / 1e9), kind=self.kind)
+        if final.get("eval_count") and final.get("eval_duration"):
+            METRICS.observe("decode_tokens_per_second", self.tokens_per_second, kind=self.kind)
+
+# PART-2 :#
+#-------------------------------------------
+# Split a document into sections of about max_tokens tokens, breaking at line boundaries
+def split_into_sections(text, max_tokens=SUMMARY_SECTION_TOKENS):
+    max_chars = TOKEN_COUNTER.chars_for(max_tokens)
+    sections = []
+    current = []
+    size = 0
+    for line in text.splitlines(keepends=True):
+        # Hard-split lines that are longer than a whole section
+        while len(line) > max_chars:
+            line_head, line = line[:max_chars], line[max_chars:]
+            if current:
+                sections.append("".join(current))
+                current, size = [], 0
+            sections.append(line_head)
+        if current and size + len(line) > max_chars:
+            sections.append("".join(current))
+            current, size = [], 0
+        current.append(line)
+        size += len(line)
+    if current:
+        sections.append("".join(current))
+    return sections
+
+SECTION_SYSTEM_PROMPT = (
+    "You are a summarization expert. Summarize this section of a longer document. "
+    "Keep the key facts, names, numbers and any tabular data."
+)
+
+# Map step: summarize one section of a longer document (non-streaming)
+def summarize_section(section, client=ollama):
+    with METRICS.span("summary_map_section"):
+        response = client.chat(
+            model=LLM_MODEL,
+            messages=[
+                {
+                    "role": "system",
+                    "content": SECTION_SYSTEM_PROMPT,
+                },
+                {"role": "user", "content": section},
+            ],
+            options=OLLAMA_OPTIONS,
+            keep_alive=OLLAMA_KEEP_ALIVE,
+        )
+    # Sections are unique text, so their prompt token counts calibrate the estimator well
+    TOKEN_COUNTER.calibrate(len(SECTION_SYSTEM_PROMPT) + len(section), response.get("prompt_eval_count"))
+    return response["message"]["content"]
+
+# Summarize sections concurrently (bounded in-flight requests) until the partial summaries fit in one section
+def reduce_sections(sections, sink=None, section_tokens=SUMMARY_SECTION_TOKENS, client=ollama):
+    level = 1
+    while len(sections) > 1 and level <= SUMMARY_MAX_LEVELS:
+        partials = [None] * len(sections)
+        with ThreadPoolExecutor(max_workers=SUMMARY_MAX_INFLIGHT) as executor:
+            futures = {executor.submit(summarize_section, section, client): i for i, section in enumerate(sections)}
+            for done, future in enumerate(as_completed(futures), start=1):
+                partials[futures[future]] = future.result()
+                if sink is not None:
+                    sink.progress(done / len(sections), f"Summarizing sections (level {level}): {done}/{len(sections)}")
+        # Partial summaries stay in document order for the next level
+        sections = split_into_sections("\n\n".join(partials), section_tokens)
+        level += 1
+    return "\n\n".join(sections)
+
+# Summaries shared by all sessions, keyed by document hash, summary type and bullet points
+@lru_cache(maxsize=None)
+def get_summary_cache():
+    return OrderedDict()
+
+# Batch summaries run on worker threads, so lookups (which reorder the LRU) and inserts take this lock
+_summary_cache_lock = threading.Lock()
+
+# Instruction for a summary type
+def summary_prompt(summary_type, bullet_points=False):
+    if summary_type == "Short":
+        return "Provide a concise summary of the text in no more than 2 sentences."
+    if summary_type == "Detailed":  # Detailed summary
+        if bullet_points:
+            return (
+                "Provide a detailed summary of the text in 6-8 lines. "
+                "Use bullet points for each key point."
+            )
+        return "Provide a detailed summary of the text in 6-8 lines."
+    if summary_type == "Tabular":
+        return "Summarize the full pdf data in a table format with max 6-7 points."
+    raise ValueError(f"Unknown summary type: {summary_type}")
+
+# Summarize document text (map-reduce for documents longer than one section), streaming into sink
+# Returns the summary text and the elapsed time
+def summarize(doc_text, summary_type, bullet_points=False, sink=None, client=ollama):
+    sink = sink or StreamCollector("summary")
+    prompt = summary_prompt(summary_type, bullet_points)
+    # Repeated requests for the same summary are answered from the cache
+    summary_cache = get_summary_cache()
+    cache_key = (hashlib.sha256(doc_text.encode("utf-8")).hexdigest(), summary_type, bullet_points)
+    with _summary_cache_lock:
+        cached_summary = summary_cache.get(cache_key)
+        if cached_summary is not None:
+            summary_cache.move_to_end(cache_key)
+    if cached_summary is not None:
+        # Deliver the cached text through the same streaming loop as a single chunk
+        return sink.stream([{"message": {"content": cached_summary}}])
+    # Size sections to the model's window, after the instructions and the answer reserve
+    budget = ContextBudget(OLLAMA_NUM_CTX)
+    budget.reserve(SECTION_SYSTEM_PROMPT if len(SECTION_SYSTEM_PROMPT) > len(prompt) else prompt)
+    budget.reserve(" The text consists of summaries of consecutive sections of one document.")
+    section_tokens = min(SUMMARY_SECTION_TOKENS, budget.remaining)
+    # Map: summarize context-sized sections concurrently, then reduce them to one text
+    sections = split_into_sections(doc_text, section_tokens)
+    if len(sections) > 1:
+        doc_text = reduce_sections(sections, sink, section_tokens, client)
+        sink.progress(None)
+        prompt += " The text consists of summaries of consecutive sections of one document."
+    # Only possible if the partial summaries stopped shrinking: keep the leading part and say so
+    doc_text = budget.truncate("the end of the document summaries", doc_text)
+    if budget.truncated:
+        sink.notice(budget.describe())
+        METRICS.observe("context_dropped_tokens", budget.dropped_tokens, kind="summary")
+    # The document comes before the instruction so every summary type shares the same prompt prefix
+    response = client.chat(
+        model=LLM_MODEL,
+        messages=[
+            {
+                "role": "system",
+                "content": "You are a summarization expert.",
+            },
+            {
+                "role": "user",
+                "content": doc_text
+            },
+            {
+                "role": "user",
+                "content": prompt
+            },
+        ],
+        stream=True,  # Enable streaming
+        options=OLLAMA_OPTIONS,
+        keep_alive=OLLAMA_KEEP_ALIVE,
+    )
+    response_text, elapsed_time = sink.stream(response)
+    if response_text:
+        with _summary_cache_lock:
+            summary_cache[cache_key] = response_text
+            while len(summary_cache) > SUMMARY_CACHE_SIZE:
+                summary_cache.popitem(last=False)
+    return response_text, elapsed_time
+
+# PART-3:#
+#-------------------------------------------
+# Bot personalities and their tone of voice
+PERSONALITY_TONES = {
+    "Neutral": "You are an excellent pdf-document chatbot.",
+    "Formal": "You are a highly professional and formal pdf-document chatbot.",
+    "Casual": "You are a friendly and casual pdf-document chatbot.",
+    "Technical": "You are a highly technical and detail-oriented pdf-document chatbot."
+}
+
+# Build the chat messages for a question
+# Nothing that changes per question (personality, question) goes into the system message,
+# so instructions + document context form a stable prefix whose KV cache Ollama reuses
+# budget (a ContextBudget) is filled in with what was sent and what did not fit
+def build_question_messages(retrieval_index, question, personality_tone, budget=None):
+    budget = budget or ContextBudget(OLLAMA_NUM_CTX)
+    instructions = (
+        "You are a pdf-document chatbot. "
+        "Give accurate and concise answers only to the question that is asked. "
+        "You are able to handle data from PDFs such as key-value pairs, tabular data, graphs, numbers, calculations, etc.\n\n"
+        "Here are the relevant excerpts from the uploaded documents:\n"
+    )
+    user_prompt = f"{personality_tone} Please answer the question: {question}"
+    budget.reserve(instructions)
+    budget.reserve(user_prompt)
+    # Only the most relevant chunks that fit in the remaining window are sent to the model
+    context = retrieval_index.build_context(question, budget)
+    return [
+        {
+            "role": "system",
+            "content": instructions + context,
+        },
+        {
+            "role": "user",
+            "content": user_prompt,
+        },
+    ]
+
+# Answer a question about the indexed documents, streaming into sink
+# Answers are cached per model, personality, question and document set when doc_fingerprint is given
+# Returns the answer, elapsed time and, for cache hits, the response time that was saved
+def answer_question(retrieval_index, question, personality_tone=PERSONALITY_TONES["Neutral"], doc_fingerprint=None,
+                    sink=None, client=ollama):
+    sink = sink or StreamCollector("answer")
+    response_cache = get_response_cache()
+    cache_key = response_cache.key(LLM_MODEL, personality_tone, question, doc_fingerprint) if doc_fingerprint else None
+    cached = response_cache.get(cache_key) if cache_key else None
+    if cached is not None:
+        # Stream the cached answer back immediately as a single chunk
+        response_text, elapsed_time = sink.stream([{"message": {"content": cached["answer"]}}])
+        return response_text, elapsed_time, max(cached["response_time"] - elapsed_time, 0.0)
+    budget = ContextBudget(OLLAMA_NUM_CTX)
+    with METRICS.span("prompt_build"):
+        messages = build_question_messages(retrieval_index, question, personality_tone, budget)
+    METRICS.observe("prompt_tokens_estimated", TOKEN_COUNTER.count_messages(messages), kind="answer")
+    # Tell the user when relevant excerpts had to be left out
+    if budget.truncated:
+        sink.notice(budget.describe())
+        METRICS.observe("context_dropped_tokens", budget.dropped_tokens, kind="answer")
+    if budget.saved_tokens:
+        sink.context_saved_tokens = budget.saved_tokens
+        METRICS.observe("dedup_saved_tokens", budget.saved_tokens, kind="answer")
+    response = client.chat(
+        model=LLM_MODEL,
+        messages=messages,
+        stream=True,  # Enable streaming
+        options=OLLAMA_OPTIONS,
+        keep_alive=OLLAMA_KEEP_ALIVE,
+    )
+    response_text, elapsed_time = sink.stream(response)
+    # No calibration here: the stable document prefix is usually served from Ollama's cache, so prompt_eval_count
+    # undercounts the prompt (summarize_section calibrates from uncached calls instead)
+    if cache_key and response_text:
+        response_cache.put(cache_key, {"answer": response_text, "response_time": elapsed_time, "created": time.time()})
+    return response_text, elapsed_time, None
@@ -0,0 +1,87 @@
+# Near-duplicate detection for passages of text (pages and retrieval chunks)
+# Each passage is reduced to a MinHash signature over word shingles, and its signature is cut into bands whose
+# keys go into locality-sensitive hash buckets. Signatures and buckets depend only on a document's content, so
+# they are built once per document (see core.DocumentIndex) and shared. A grouping over several documents then
+# only compares a new passage with the few earlier ones that share a band instead of with every passage seen so
+# far. Passages whose estimated Jaccard similarity reaches the threshold form a group; the first passage of a
+# group represents it and the later ones point at it.
+import os
+import re
+import zlib
+from functools import lru_cache
+#-------------------------------------------
+# Dedup settings (can be overridden through environment variables)
+DEDUP_THRESHOLD = float(os.environ.get("PDF_CHATBOT_DEDUP_THRESHOLD", 0.8))  # Similarity for a match; 0 disables
+SHINGLE_WORDS = 3  # Words per shingle (short, so a few edited words do not break a match)
+LSH_BANDS = 16  # 16 bands of 4 values: passages at 0.8 similarity share a band with 99.9% probability
+LSH_ROWS = 4
+MERSENNE_PRIME = (1 << 31) - 1
+WORD_PATTERN = re.compile(r"\w+")
+
+# Random hash functions (a * x + b) mod p, one per signature value; the fixed seed keeps signatures stable
+@lru_cache(maxsize=None)
+def minhash_permutations(count=LSH_BANDS * LSH_ROWS):
+    import numpy as np
+    rng = np.random.default_rng(20240601)
+    return (rng.integers(1, MERSENNE_PRIME, count, dtype="uint64")[:, None],
+            rng.integers(0, MERSENNE_PRIME, count, dtype="uint64")[:, None])
+
+# MinHash signature of a text (None if it has no words)
+def minhash_signature(text):
+    import numpy as np
+    words = WORD_PATTERN.findall(text.lower())
+    if not words:
+        return None
+    shingles = {" ".join(words[i:i + SHINGLE_WORDS]) for i in range(max(len(words) - SHINGLE_WORDS + 1, 1))}
+    hashes = np.fromiter((zlib.crc32(shingle.encode()) & MERSENNE_PRIME for shingle in shingles), dtype="uint64",
+                         count=len(shingles))
+    a, b = minhash_permutations()
+    return ((a * hashes + b) % MERSENNE_PRIME).min(axis=1)
+
+# Estimated Jaccard similarity of two signatures
+def signature_similarity(first, second):
+    return float((first == second).mean())
+
+# LSH bucket keys of a signature, one per band
+def band_keys(signature):
+    return [(band, signature[band * LSH_ROWS:(band + 1) * LSH_ROWS].tobytes()) for band in range(LSH_BANDS)]
+
+# Near-duplicate groups over passages of several documents
+# A passage is a (source, position) key; each source brings its own signatures and buckets, of which only the
+# positions below a limit (those added to the grouping so far) are candidates. Only passages that repeat an
+# earlier one are recorded, so a grouping costs memory in proportion to the duplicates it finds.
+class DuplicateGroups:
+    def __init__(self, threshold=DEDUP_THRESHOLD):
+        self.threshold = threshold
+        self.representatives = {}  # Key -> key of its group's representative, for duplicates only
+        self.members = {}  # Representative key -> keys of the group in arrival order, for groups of 2+ only
+
+    # Record a passage; sources are (source, signatures, buckets, limit) tuples for the passages seen so far
+    # Returns the key of its group's representative
+    def add(self, key, signature, sources):
+        representative = key
+        if signature is not None and self.threshold > 0:
+            bands = band_keys(signature)
+            best = 0.0
+            for source, signatures, buckets, limit in sources:
+                candidates = {position for band in bands for position in buckets.get(band, ()) if position < limit}
+                for position in candidates:
+                    similarity = signature_similarity(signature, signatures[position])
+                    if similarity >= self.threshold and similarity > best:
+                        representative, best = (source, position), similarity
+            representative = self.representative(representative)
+        if representative != key:
+            self.representatives[key] = representative
+            self.members.setdefault(representative, [representative]).append(key)
+        return representative
+
+    def representative(self, key):
+        return self.representatives.get(key, key)
+
+    # Keys of the group a representative stands for, in arrival order
+    def group(self, key):
+        return self.members.get(key, [key])
+
+    # Number of groups with more than one passage
+    def duplicate_groups(self):
+        return len(self.members)
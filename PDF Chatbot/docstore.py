@@ -0,0 +1,205 @@
+# Process-wide document store for extracted text
+# Each document's pages are written once, as UTF-8, to a file that is memory-mapped for reading, with compact
+# arrays of page byte offsets and per-page metadata (character count, text layer, table count). Sessions only
+# hold references to StoredDocument objects, and identical uploads (same content hash) share one copy, along with
+# the indexes built from it (see StoredDocument.indexes), so memory stays flat as concurrent sessions grow.
+# The store holds documents weakly: once no session references a document, its map, file and indexes are freed.
+# Page records (e.g. on search hits) are small views created on demand, not stored.
+# This module is imported (not re-executed) by Streamlit, so DOCUMENT_STORE is shared by every session.
+import atexit
+import mmap
+import os
+import shutil
+import tempfile
+import threading
+import weakref
+from array import array
+from collections import defaultdict
+#-------------------------------------------
+# Files live in a per-process temporary directory unless one is configured (the extraction cache handles restarts)
+DOCSTORE_DIR = os.environ.get("PDF_CHATBOT_DOCSTORE_DIR")
+
+# One page of a stored document (1-based number); everything is read from the document's arrays and buffer
+class Page:
+    __slots__ = ("document", "number")
+
+    def __init__(self, document, number):
+        self.document = document
+        self.number = number
+
+    @property
+    def text(self):
+        return self.document.page_text(self.number)
+
+    @property
+    def char_count(self):
+        return self.document.char_counts[self.number - 1]
+
+    @property
+    def table_count(self):
+        return self.document.table_counts[self.number - 1]
+
+    def __repr__(self):
+        return f"Page({self.number}, {self.char_count} chars, {self.table_count} tables)"
+
+# Remove a document's file once the document is gone
+def _remove_file(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+# Slots keep the many per-session references cheap; __weakref__ lets the store and caches hold documents weakly
+class StoredDocument:
+    __slots__ = ("path", "offsets", "char_counts", "text_layers", "table_counts", "tables", "indexes", "_file", "_map",
+                 "_lock", "__weakref__")
+
+    def __init__(self, path):
+        self.path = path
+        self.offsets = array("Q", [0])  # Byte offset where each page starts, plus the end of the last page
+        self.char_counts = array("I")  # Characters of each page's decoded text (pages are UTF-8, so not byte counts)
+        self.text_layers = array("B")  # 1 if the page has extractable text, 0 if it is blank (e.g. a scanned image)
+        self.table_counts = array("H")  # Tables found on each page
+        self.tables = []  # Tables found at extraction time (see extraction.extract_page_tables)
+        # Indexes derived from the text (retrieval, search), keyed by kind; built once and shared with the document
+        self.indexes = {}
+        self._file = open(path, "w+b")
+        self._map = None
+        self._lock = threading.Lock()
+        weakref.finalize(self, _remove_file, path)
+
+    @property
+    def page_count(self):
+        return len(self.offsets) - 1
+
+    @property
+    def nbytes(self):
+        return self.offsets[-1]
+
+    # Append the next page and its tables (used while the document is being extracted)
+    def append_page(self, page_text, page_tables=()):
+        data = page_text.encode("utf-8")
+        with self._lock:
+            self._file.write(data)
+            self._file.flush()
+            self.offsets.append(self.offsets[-1] + len(data))
+            self.char_counts.append(len(page_text))
+            self.text_layers.append(1 if page_text.strip() else 0)
+            self.table_counts.append(len(page_tables))
+            self.tables.extend(page_tables)
+
+    # Zero-copy view of bytes [start, end); the file is re-mapped when it has grown past the current map
+    def _view(self, start, end):
+        if end <= start:
+            return memoryview(b"")
+        with self._lock:
+            if self._map is None or len(self._map) < end:
+                # The old map is not closed: views handed out earlier keep it alive until they are released
+                self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            return memoryview(self._map)[start:end]
+
+    # Raw UTF-8 bytes of pages first_page..last_page (1-based, inclusive) as a zero-copy view
+    def page_bytes(self, first_page, last_page=None):
+        last_page = last_page or first_page
+        return self._view(self.offsets[first_page - 1], self.offsets[last_page])
+
+    # Decoded text of one page (1-based)
+    def page_text(self, page_num):
+        return str(self.page_bytes(page_num), "utf-8")
+
+    # Decoded text of a page range, or of the whole document
+    def text(self, first_page=1, last_page=None):
+        last_page = last_page or self.page_count
+        if self.page_count == 0:
+            return ""
+        return str(self.page_bytes(first_page, last_page), "utf-8")
+
+    # Page record for a page number (1-based)
+    def page(self, page_num):
+        if not 1 <= page_num <= self.page_count:
+            raise IndexError(f"page {page_num} out of range 1..{self.page_count}")
+        return Page(self, page_num)
+
+    # Page numbers without a text layer (nothing to search, cite or summarize on them)
+    def pages_without_text(self):
+        return [page_num for page_num, has_text in enumerate(self.text_layers, start=1) if not has_text]
+
+    # Map the finished file once and release the file handle
+    def seal(self):
+        with self._lock:
+            if self.offsets[-1] and (self._map is None or len(self._map) < self.offsets[-1]):
+                self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            self._file.close()
+
+    def close(self):
+        with self._lock:
+            if self._map is not None:
+                try:
+                    self._map.close()
+                except BufferError:
+                    pass  # Still referenced by a view; freed with it
+                self._map = None
+            self._file.close()
+
+class DocumentStore:
+    def __init__(self, directory=DOCSTORE_DIR):
+        self.owns_directory = directory is None
+        self.directory = directory or tempfile.mkdtemp(prefix="pdf-chatbot-docstore-")
+        self.documents = weakref.WeakValueDictionary()  # Content hash -> complete StoredDocument still in use
+        self._lock = threading.Lock()
+        self._counter = 0
+        os.makedirs(self.directory, exist_ok=True)
+
+    # Complete document for a content hash, or None
+    def get(self, content_hash):
+        return self.documents.get(content_hash)
+
+    # New document to append pages to; it is private to the caller until commit()
+    def create(self):
+        with self._lock:
+            self._counter += 1
+            path = os.path.join(self.directory, f"document-{self._counter}.txt")
+        return StoredDocument(path)
+
+    # Document built from an in-memory list of pages and their tables (not shared)
+    def from_pages(self, pages, tables=()):
+        document = self.create()
+        page_tables = defaultdict(list)
+        for table in tables:
+            page_tables[table["page"]].append(table)
+        for page_num, page_text in enumerate(pages, start=1):
+            document.append_page(page_text, page_tables.pop(page_num, ()))
+        # Tables with a page number outside the document are kept, though they count on no page
+        document.tables.extend(table for remaining in page_tables.values() for table in remaining)
+        document.seal()
+        return document
+
+    # Publish a finished document under its content hash; if another session got there first, use that copy
+    # The losing copy stays readable: the session's indexes may still point at it until they switch over, and it is
+    # freed (file included) once they have
+    def commit(self, content_hash, document):
+        document.seal()
+        with self._lock:
+            existing = self.documents.get(content_hash)
+            if existing is not None:
+                return existing
+            self.documents[content_hash] = document
+            return document
+
+    # Drop a private document that will not be committed and that nothing reads any more
+    def discard(self, document):
+        document.close()
+        try:
+            os.remove(document.path)
+        except OSError:
+            pass
+
+    # Number of shared documents in use and their total size in bytes
+    def stats(self):
+        documents = list(self.documents.values())
+        return len(documents), sum(document.nbytes for document in documents)
+
+# Process-wide store
+DOCUMENT_STORE = DocumentStore()
+if DOCUMENT_STORE.owns_directory:
+    atexit.register(shutil.rmtree, DOCUMENT_STORE.directory, True)
@@ -0,0 +1,114 @@
+# Page-sharded PDF text and table extraction engine
+# Large documents are split into page ranges that are extracted by a process pool.
+# Each worker opens the document once (in its initializer) and then serves any number of ranges.
+# The worker functions live in this module (not app.py) so spawned processes can import them.
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+import fitz  # PyMuPDF
+from metrics import METRICS  # Process-wide latency/token histograms with Prometheus and JSONL export
+#-------------------------------------------
+# Engine settings (can be overridden through environment variables)
+EXTRACT_WORKERS = int(os.environ.get("PDF_CHATBOT_EXTRACT_WORKERS", os.cpu_count() or 1))  # Processes per large document
+EXTRACT_PAGES_PER_TASK = int(os.environ.get("PDF_CHATBOT_PAGES_PER_TASK", 50))  # Pages in one range
+EXTRACT_PROCESS_MIN_PAGES = int(os.environ.get("PDF_CHATBOT_PROCESS_MIN_PAGES", 200))  # Smaller documents stay in-process
+EXTRACT_TABLES = os.environ.get("PDF_CHATBOT_EXTRACT_TABLES", "1") != "0"  # Run PyMuPDF's table finder on each page
+
+# Document opened by the current worker process
+_worker_document = None
+
+# Worker initializer: open the document once for all ranges this process extracts
+def _init_worker(pdf_bytes):
+    global _worker_document
+    _worker_document = fitz.open(stream=pdf_bytes, filetype="pdf")
+
+# Ruled tables on a page as JSON-serializable dicts: page (1-based), bbox, header names and body rows
+# The finder costs 100+ ms on a whole page (most of it looking for header text above each table), so pages
+# without vector drawings (no ruling lines) are skipped and the page is temporarily cropped to the drawings;
+# that is ~30 ms for a page with a table. Headers must then be inside the grid, as they are in ruled tables.
+def extract_page_tables(page):
+    drawings = page.get_cdrawings()
+    if not drawings:
+        return []
+    # Lines have zero-height or zero-width rects, so the bounding box is built from the coordinates
+    # A 1 pt margin keeps the outermost rulings inside the crop (without it the last column is lost); it is too
+    # narrow for text just outside the ruling to be taken for a header
+    x0, y0, x1, y1 = zip(*(drawing["rect"] for drawing in drawings))
+    clip = fitz.Rect(min(x0) - 1, min(y0) - 1, max(x1) + 1, max(y1) + 1) & page.rect
+    original_cropbox = page.cropbox
+    crop = page.rotation == 0 and not clip.is_empty  # Drawing coordinates only match the cropbox when unrotated
+    offset = (0, 0, 0, 0)
+    try:
+        if crop:
+            page.set_cropbox(clip + (original_cropbox.x0, original_cropbox.y0, original_cropbox.x0, original_cropbox.y0))
+            offset = (clip.x0, clip.y0, clip.x0, clip.y0)
+        found = page.find_tables().tables
+        tables = []
+        for table in found:
+            # Cells wrapped over several lines are joined back into one line
+            rows = [[" ".join((cell or "").split()) for cell in row] for row in table.extract()]
+            header = [" ".join((name or "").split()) for name in table.header.names]
+            if not table.header.external and rows:
+                rows = rows[1:]  # The header is the first extracted row
+            if rows:
+                bbox = [round(value + shift, 1) for value, shift in zip(table.bbox, offset)]
+                tables.append({"page": page.number + 1, "bbox": bbox, "header": header, "rows": rows})
+    finally:
+        if crop:
+            page.set_cropbox(original_cropbox)
+    return tables
+
+# Text and tables of one page
+# Tables are best-effort: if the finder fails on a page, the page keeps its text and its tables come back as None,
+# which iter_extract_pages counts (in the parent process, so failures in pool workers are counted too)
+def extract_page(page, tables=EXTRACT_TABLES):
+    page_text = page.get_text("text")
+    if not tables:
+        return page_text, []
+    try:
+        return page_text, extract_page_tables(page)
+    except Exception:
+        return page_text, None
+
+# Extract the text and tables of pages [start, end) from the worker's document
+def _extract_page_range(start, end, tables=EXTRACT_TABLES):
+    return [extract_page(_worker_document[page_num], tables) for page_num in range(start, end)]
+
+# Split page_count pages into consecutive [start, end) ranges
+def page_ranges(page_count, pages_per_task=EXTRACT_PAGES_PER_TASK):
+    step = max(pages_per_task, 1)
+    return [(start, min(start + step, page_count)) for start in range(0, page_count, step)]
+
+# Generator over (page_index, page_text, page_tables) in page order, sharding large documents across processes
+# Pages are yielded as soon as their range is extracted, so callers can show progress and index early
+def iter_extract_pages(pdf_bytes, workers=EXTRACT_WORKERS, pages_per_task=EXTRACT_PAGES_PER_TASK,
+                       min_pages=EXTRACT_PROCESS_MIN_PAGES, tables=EXTRACT_TABLES):
+    with fitz.open(stream=pdf_bytes, filetype="pdf") as pdf_document:
+        page_count = pdf_document.page_count
+        ranges = page_ranges(page_count, pages_per_task)
+        if workers <= 1 or page_count < min_pages or len(ranges) < 2:
+            for page_index, page in enumerate(pdf_document):
+                page_text, page_tables = extract_page(page, tables)
+                yield page_index, page_text, _checked_tables(page_tables)
+            return
+    # "spawn" avoids forking the multi-threaded Streamlit server process
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=min(workers, len(ranges)), mp_context=context,
+                             initializer=_init_worker, initargs=(pdf_bytes,)) as executor:
+        starts, ends = zip(*ranges)
+        # map() keeps the ranges in page order
+        for start, range_pages in zip(starts, executor.map(_extract_page_range, starts, ends, [tables] * len(ranges))):
+            for offset, (page_text, page_tables) in enumerate(range_pages):
+                yield start + offset, page_text, _checked_tables(page_tables)
+
+# Tables of a page as returned by extract_page, counting a failed table finder as no tables
+def _checked_tables(page_tables):
+    if page_tables is None:
+        METRICS.inc("table_extract_failures")
+        return []
+    return page_tables
+
+# Number of pages in a PDF (only the page tree is read, not the page contents)
+def count_pages(pdf_bytes):
+    with fitz.open(stream=pdf_bytes, filetype="pdf") as pdf_document:
+        return pdf_document.page_count
@@ -0,0 +1,105 @@
+# Bounded, append-only conversation history
+# Entries are only ever appended. Each entry's bubble HTML is rendered once, when it is added, so showing the
+# history costs as much as the visible window. At most max_entries entries (and their HTML) stay in memory; older
+# ones are spilled to a per-conversation JSON Lines file with an array of line offsets, so any page of them can be
+# read back without scanning the file; window() returns any range of entries, oldest first.
+import atexit
+import json
+import os
+import shutil
+import tempfile
+import threading
+import weakref
+from array import array
+from collections import deque
+from itertools import islice
+#-------------------------------------------
+# History settings (can be overridden through environment variables)
+HISTORY_MAX_ENTRIES = int(os.environ.get("PDF_CHATBOT_HISTORY_MAX_ENTRIES", 500))  # Entries kept in memory; 0 keeps all
+HISTORY_DIR = os.environ.get("PDF_CHATBOT_HISTORY_DIR")  # Spill files; a per-process temporary directory by default
+
+_spill_directory = None
+_spill_lock = threading.Lock()
+
+# Directory for spill files, created on first use
+def get_spill_directory():
+    global _spill_directory
+    with _spill_lock:
+        if _spill_directory is None:
+            if HISTORY_DIR:
+                os.makedirs(HISTORY_DIR, exist_ok=True)
+                _spill_directory = HISTORY_DIR
+            else:
+                _spill_directory = tempfile.mkdtemp(prefix="pdf-chatbot-history-")
+                atexit.register(shutil.rmtree, _spill_directory, True)
+        return _spill_directory
+
+# Remove a spill file once its history is gone
+def _remove_file(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+class ConversationHistory:
+    def __init__(self, render=None, max_entries=HISTORY_MAX_ENTRIES):
+        self.render = render  # Entry -> HTML; None stores no HTML
+        self.max_entries = max_entries
+        self.entries = deque()  # Entries kept in memory, oldest first
+        self.html = deque()  # Rendered HTML of each entry in memory
+        self.version = 0  # Bumped on every append, so derived data (exports) can be cached per version
+        self.spill_path = None
+        self.spill_offsets = array("Q", [0])  # Byte offset of each spilled line, plus the end of the file
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return self.spilled + len(self.entries)
+
+    @property
+    def spilled(self):
+        return len(self.spill_offsets) - 1
+
+    def append(self, entry):
+        with self._lock:
+            self.entries.append(entry)
+            self.html.append(self.render(entry) if self.render else "")
+            while self.max_entries and len(self.entries) > self.max_entries:
+                self._spill(self.entries.popleft())
+                self.html.popleft()
+            self.version += 1
+
+    def _spill(self, entry):
+        if self.spill_path is None:
+            handle, self.spill_path = tempfile.mkstemp(prefix="history-", suffix=".jsonl", dir=get_spill_directory())
+            os.close(handle)
+            weakref.finalize(self, _remove_file, self.spill_path)
+        data = (json.dumps(entry) + "\n").encode("utf-8")
+        with open(self.spill_path, "ab") as f:
+            f.write(data)
+        self.spill_offsets.append(self.spill_offsets[-1] + len(data))
+
+    # Spilled entries start..end-1, read back from disk
+    def _read_spilled(self, start, end):
+        if start >= end:
+            return []
+        with open(self.spill_path, "rb") as f:
+            f.seek(self.spill_offsets[start])
+            data = f.read(self.spill_offsets[end] - self.spill_offsets[start])
+        return [json.loads(line) for line in data.splitlines()]
+
+    # Entries at positions start..end-1 (0 is the oldest)
+    def window(self, start, end):
+        with self._lock:
+            start, end = max(start, 0), min(end, len(self))
+            spilled = self.spilled
+            return self._read_spilled(start, min(end, spilled)) + list(
+                islice(self.entries, max(start - spilled, 0), max(end - spilled, 0))
+            )
+
+    # HTML of the entries at positions start..end-1; spilled entries are rendered again as they are read back
+    def html_window(self, start, end):
+        with self._lock:
+            start, end = max(start, 0), min(end, len(self))
+            spilled = self.spilled
+            older = [self.render(entry) if self.render else "" for entry in self._read_spilled(start, min(end, spilled))]
+            return older + list(islice(self.html, max(start - spilled, 0), max(end - spilled, 0)))
@@ -0,0 +1,159 @@
+# Background export of a conversation history to JSON Lines, Markdown or PDF
+# Each conversation keeps one HistoryExport per format: a temporary file written by a shared worker pool, so the
+# Streamlit script only submits the job and later offers the file for download. The file is reused while the
+# history version is unchanged. Because the history is append-only, a later export writes only the new turns:
+# JSONL and Markdown files are appended to, and the PDF is redrawn from line layouts kept in a JSONL file next to
+# it, so simpleSplit runs once per message and only one batch of entries is held in memory at a time. (A PDF cannot
+# be appended to in place; reportlab writes it on save.)
+import json
+import os
+import tempfile
+import threading
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from history import get_spill_directory
+#-------------------------------------------
+EXPORT_WORKERS = int(os.environ.get("PDF_CHATBOT_EXPORT_WORKERS", 2))  # Exports written at the same time (all sessions)
+EXPORT_BATCH_ENTRIES = 200  # Entries read from the history and written per step
+# Format -> (label, MIME type, file extension)
+EXPORT_FORMATS = {
+    "pdf": ("PDF", "application/pdf", ".pdf"),
+    "md": ("Markdown", "text/markdown", ".md"),
+    "jsonl": ("JSON Lines", "application/x-ndjson", ".jsonl"),
+}
+PDF_FONT = "Helvetica"
+PDF_FONT_SIZE = 12
+PDF_MARGIN = 40
+PDF_LINE_HEIGHT = 20
+
+# Worker pool shared by every session
+@lru_cache(maxsize=None)
+def get_export_executor():
+    return ThreadPoolExecutor(max_workers=EXPORT_WORKERS, thread_name_prefix="history-export")
+
+# Remove an export file once its export is gone
+def _remove_file(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+# Message text as exported: the content plus its response time, if any
+def entry_text(entry):
+    content = entry["content"]
+    response_time = entry.get("response_time", None)
+    if response_time is not None:
+        content += f" (Response Time: {response_time:.2f} seconds)"
+    return content
+
+def entry_role(entry):
+    return "User" if entry["role"] == "user" else "Bot"
+
+class HistoryExport:
+    def __init__(self, export_format):
+        self.format = export_format
+        handle, self.path = tempfile.mkstemp(prefix="export-", suffix=EXPORT_FORMATS[export_format][2], dir=get_spill_directory())
+        os.close(handle)
+        weakref.finalize(self, _remove_file, self.path)
+        self.layout_path = self.path + ".layout.jsonl"  # PDF only: [role, wrapped lines] per entry
+        weakref.finalize(self, _remove_file, self.layout_path)
+        self.written = 0  # History entries already in the file (or, for PDF, in the layout file)
+        self.version = None  # History version the file matches
+        self.total = 0  # Entries in the export being written, for progress
+        self.error = None
+        self._future = None
+        self._lock = threading.Lock()
+
+    @property
+    def running(self):
+        return self._future is not None and not self._future.done()
+
+    # True when the file matches the history's current version
+    def ready(self, history):
+        return not self.running and self.error is None and self.version == history.version
+
+    # Start bringing the file up to date in the background (no-op if it already is, or is being written)
+    def start(self, history):
+        with self._lock:
+            if self.running or (self.version == history.version and self.error is None):
+                return
+            self.error = None
+            self.total = len(history)
+            self._future = get_export_executor().submit(self._write, history, history.version, len(history))
+
+    # Block until the write in progress (if any) has finished
+    def wait(self, timeout=None):
+        future = self._future
+        if future is not None:
+            future.result(timeout)
+
+    def _write(self, history, version, count):
+        try:
+            if self.format == "pdf":
+                self._write_pdf(history, count)
+            else:
+                self._append_text(history, count)
+            self.version = version
+        except Exception as e:
+            self.error = str(e)
+
+    # Append the new entries to a JSONL or Markdown file, one batch at a time
+    def _append_text(self, history, count):
+        with open(self.path, "a", encoding="utf-8") as f:
+            if self.written == 0 and self.format == "md":
+                f.write("# PDF Chatbot - Conversation History\n\n")
+            while self.written < count:
+                batch = history.window(self.written, min(self.written + EXPORT_BATCH_ENTRIES, count))
+                for entry in batch:
+                    if self.format == "jsonl":
+                        f.write(json.dumps(entry) + "\n")
+                    else:
+                        f.write(f"**{entry_role(entry)}:** {entry_text(entry)}\n\n")
+                f.flush()
+                self.written += len(batch)
+
+    # Wrap the new entries into the layout file, then draw every layout, streamed back from it, into a fresh PDF
+    # that replaces the old file
+    def _write_pdf(self, history, count):
+        from reportlab.lib.pagesizes import letter
+        from reportlab.lib.utils import simpleSplit
+        from reportlab.pdfgen import canvas
+        width, height = letter
+        line_width = width - 2 * PDF_MARGIN  # Adjust line width for margins
+        with open(self.layout_path, "a", encoding="utf-8") as f:
+            while self.written < count:
+                batch = history.window(self.written, min(self.written + EXPORT_BATCH_ENTRIES, count))
+                for entry in batch:
+                    lines = simpleSplit(entry_text(entry), PDF_FONT, PDF_FONT_SIZE, line_width)
+                    f.write(json.dumps([entry_role(entry), lines]) + "\n")
+                f.flush()
+                self.written += len(batch)
+        partial_path = self.path + ".partial"
+        c = canvas.Canvas(partial_path, pagesize=letter)
+        y = height - PDF_MARGIN  # Start at the top of the page, leaving some margin
+        c.setFont(PDF_FONT, PDF_FONT_SIZE)
+        c.drawString(PDF_MARGIN, y, "PDF Chatbot - Conversation History")
+        y -= 30
+        with open(self.layout_path, encoding="utf-8") as f:
+            for layout in f:
+                role, lines = json.loads(layout)
+                c.drawString(PDF_MARGIN, y, f"{role}:")
+                y -= PDF_LINE_HEIGHT
+                for line in lines:
+                    c.drawString(PDF_MARGIN + 20, y, line)  # Indent for content lines
+                    y -= PDF_LINE_HEIGHT
+                    if y < PDF_MARGIN:  # Check if we need a new page
+                        c.showPage()
+                        y = height - PDF_MARGIN
+                        c.setFont(PDF_FONT, PDF_FONT_SIZE)
+        c.save()
+        os.replace(partial_path, self.path)
+
+    # Contents of the finished file (read only when the user clicks download)
+    def read_bytes(self):
+        with open(self.path, "rb") as f:
+            return f.read()
+
+    def file_name(self):
+        return "chat_history" + EXPORT_FORMATS[self.format][2]
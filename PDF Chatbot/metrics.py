@@ -0,0 +1,187 @@
+# Lightweight in-process instrumentation for the PDF chatbot
+# Observations are kept as fixed-bucket histograms (one per metric name + labels) and, only when a metrics
+# directory is configured (PDF_CHATBOT_METRICS_DIR), periodically exported as Prometheus text (metrics.prom) and
+# raw events (metrics.jsonl, rotated to metrics.jsonl.1 once it reaches its size cap).
+# This module is imported (not re-executed) by Streamlit, so the registry below is shared by every session.
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+#-------------------------------------------
+# Export settings (can be overridden through environment variables)
+METRICS_DIR = os.environ.get("PDF_CHATBOT_METRICS_DIR", "")  # Empty (the default) disables the export
+METRICS_EXPORT_SECONDS = float(os.environ.get("PDF_CHATBOT_METRICS_EXPORT_SECONDS", 15))  # 0 also disables it
+METRICS_EVENTS_MAX_BYTES = int(os.environ.get("PDF_CHATBOT_METRICS_EVENTS_MB", 64)) * 1024 * 1024  # Per events file
+METRICS_PREFIX = "pdf_chatbot_"
+# Bucket upper bounds per kind of value
+SECONDS_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+COUNT_BUCKETS = (10, 50, 100, 250, 500, 1000, 2000, 4000, 8000, 16000, 32000, 64000, 128000)
+RATE_BUCKETS = (1, 5, 10, 20, 40, 80, 160, 320, 640, 1280, 2560)
+
+# Pick buckets from the metric name suffix
+def buckets_for(name):
+    if name.endswith("_seconds"):
+        return SECONDS_BUCKETS
+    if name.endswith("_per_second"):
+        return RATE_BUCKETS
+    return COUNT_BUCKETS
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # Last slot is +Inf
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    # Approximate quantile: upper bound of the bucket that contains it
+    def quantile(self, q):
+        if not self.count:
+            return None
+        target = q * self.count
+        seen = 0
+        for bound, bucket_count in zip(self.buckets + (float("inf"),), self.counts):
+            seen += bucket_count
+            if seen >= target:
+                return bound
+        return float("inf")
+
+class Metrics:
+    def __init__(self, directory=METRICS_DIR, export_seconds=METRICS_EXPORT_SECONDS,
+                 events_max_bytes=METRICS_EVENTS_MAX_BYTES):
+        self.directory = directory
+        self.export_seconds = export_seconds
+        self.events_max_bytes = events_max_bytes
+        self.lock = threading.Lock()
+        self.histograms = {}  # (name, sorted label items) -> Histogram
+        self.counters = {}  # (name, sorted label items) -> value
+        self.events = []  # Raw observations waiting for the JSONL export
+        self._exporter = None
+
+    # Record one value for a histogram
+    def observe(self, name, value, **labels):
+        if value is None:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram(buckets_for(name))
+            histogram.observe(value)
+            if self.exporting:
+                self.events.append({"ts": time.time(), "metric": name, "value": value, **labels})
+        self._start_exporter()
+
+    # Whether observations are exported (raw events are only buffered then)
+    @property
+    def exporting(self):
+        return bool(self.directory) and self.export_seconds > 0
+
+    # Increase a counter
+    def inc(self, name, amount=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    # Time a block of code into the histogram "<name>_seconds"
+    @contextmanager
+    def span(self, name, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(f"{name}_seconds", time.perf_counter() - start, **labels)
+
+    # Summary rows for display: metric, labels, count, mean and approximate p50/p95
+    def snapshot(self):
+        with self.lock:
+            rows = []
+            for (name, labels), histogram in sorted(self.histograms.items()):
+                rows.append({
+                    "metric": name,
+                    "labels": ", ".join(f"{k}={v}" for k, v in labels),
+                    "count": histogram.count,
+                    "mean": histogram.sum / histogram.count,
+                    "p50": histogram.quantile(0.5),
+                    "p95": histogram.quantile(0.95),
+                })
+            for (name, labels), value in sorted(self.counters.items()):
+                rows.append({"metric": name, "labels": ", ".join(f"{k}={v}" for k, v in labels), "count": value,
+                             "mean": None, "p50": None, "p95": None})
+            return rows
+
+    # Prometheus text exposition format
+    def prometheus_text(self):
+        def label_text(labels, extra=()):
+            items = list(labels) + list(extra)
+            if not items:
+                return ""
+            return "{" + ",".join(f'{k}="{str(v).replace(chr(34), chr(39))}"' for k, v in items) + "}"
+        lines = []
+        with self.lock:
+            typed = set()
+            for (name, labels), histogram in sorted(self.histograms.items()):
+                full_name = METRICS_PREFIX + name
+                if full_name not in typed:
+                    lines.append(f"# TYPE {full_name} histogram")
+                    typed.add(full_name)
+                cumulative = 0
+                for bound, bucket_count in zip(histogram.buckets + (float("inf"),), histogram.counts):
+                    cumulative += bucket_count
+                    le = "+Inf" if bound == float("inf") else repr(bound)
+                    lines.append(f"{full_name}_bucket{label_text(labels, [('le', le)])} {cumulative}")
+                lines.append(f"{full_name}_sum{label_text(labels)} {histogram.sum}")
+                lines.append(f"{full_name}_count{label_text(labels)} {histogram.count}")
+            for (name, labels), value in sorted(self.counters.items()):
+                full_name = f"{METRICS_PREFIX}{name}_total"
+                if full_name not in typed:
+                    lines.append(f"# TYPE {full_name} counter")
+                    typed.add(full_name)
+                lines.append(f"{full_name}{label_text(labels)} {value}")
+        return "\n".join(lines) + "\n"
+
+    # Write metrics.prom (snapshot) and append pending events to metrics.jsonl
+    def export(self):
+        os.makedirs(self.directory, exist_ok=True)
+        prom_path = os.path.join(self.directory, "metrics.prom")
+        with open(f"{prom_path}.tmp", "w") as f:
+            f.write(self.prometheus_text())
+        os.replace(f"{prom_path}.tmp", prom_path)
+        with self.lock:
+            events, self.events = self.events, []
+        if events:
+            events_path = os.path.join(self.directory, "metrics.jsonl")
+            try:
+                if os.path.getsize(events_path) >= self.events_max_bytes:
+                    os.replace(events_path, f"{events_path}.1")  # Keep one older file; the one before it is dropped
+            except OSError:
+                pass
+            with open(events_path, "a") as f:
+                f.writelines(json.dumps(event) + "\n" for event in events)
+
+    # Background thread that exports every export_seconds
+    def _start_exporter(self):
+        if self._exporter is not None or not self.exporting:
+            return
+        with self.lock:
+            if self._exporter is not None:
+                return
+            self._exporter = threading.Thread(target=self._export_loop, name="metrics-export", daemon=True)
+        self._exporter.start()
+
+    def _export_loop(self):
+        while True:
+            time.sleep(self.export_seconds)
+            try:
+                self.export()
+            except OSError:
+                pass
+
+# Process-wide registry
+METRICS = Metrics()